@@ -1,19 +1,40 @@
 import os
 import base64
-import requests
 import time
 import json
-from flask import Flask, render_template, request, jsonify, redirect, url_for, flash
+import math
+from flask import (Flask, render_template, request, jsonify, redirect, url_for, flash, send_file, abort, g,
+                   Response, stream_with_context)
 from werkzeug.utils import secure_filename
-from dotenv import load_dotenv
 from PIL import Image
 import io
 import uuid
 import hashlib
+import tempfile
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, wait, as_completed
+from collections import namedtuple
+from dotenv import load_dotenv
 
-# Load environment variables
+# Load environment variables before the modules below read them at import time
+# (metrics picks its sample storage from PROMETHEUS_MULTIPROC_DIR)
 load_dotenv()
 
+import tracing
+import metrics
+from memory_cache import MemoryCache
+from preprocess import normalize_image
+from phash import PerceptualIndex, dhash
+from janitor import default_quota, start_janitor, scan_folder
+from cache_index import CacheIndex
+from singleflight import SingleFlight
+from upstream import UpstreamClient, ALT_CONTENT_TYPE, alt_payload
+from hedging import Hedger
+from capture import TrafficCapture
+from circuit_breaker import CircuitBreaker, NegativeCache, CircuitOpen, UpstreamRejected
+from rate_limit import TokenBucket, RateLimitExceeded
+from jobs import JobStore, JobQueue, QueueFull
+
 app = Flask(__name__)
 app.secret_key = os.urandom(24)
 
@@ -21,7 +42,15 @@ app.secret_key = os.urandom(24)
 UPLOAD_FOLDER = 'static/uploads'
 RESULT_FOLDER = 'static/results'
 CACHE_FOLDER = 'static/cache'
+GARMENT_FOLDER = 'static/garments'  # Catalog garments addressable by id in batch requests
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg'}
+CACHE_ROUTE_PREFIX = 'cache/'  # Results served straight from the cache by cached_result()
+REJECTED_STATUSES = {400, 413, 415, 422}  # Upstream answers that mean "these images will never work"
+HASH_CHUNK_SIZE = 64 * 1024  # Read uploads in 64KB chunks while hashing
+DOWNLOAD_CHUNK_SIZE = 64 * 1024  # Stream result downloads to disk in 64KB chunks
+
+# An image read once per request: where it lives, its digest and its bytes
+HashedImage = namedtuple('HashedImage', ['path', 'digest', 'data'])
 
 # Create directories if they don't exist
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
@@ -31,15 +60,109 @@ os.makedirs(CACHE_FOLDER, exist_ok=True)
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['RESULT_FOLDER'] = RESULT_FOLDER
 app.config['CACHE_FOLDER'] = CACHE_FOLDER
+app.config['GARMENT_FOLDER'] = GARMENT_FOLDER
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max upload size
-app.config['RATE_LIMIT_SECONDS'] = 300  # 5 minutes (300 seconds) between API calls
+app.config['IMAGE_NORMALIZE'] = os.getenv('IMAGE_NORMALIZE', '1').lower() not in ('0', 'false', 'no')
+app.config['IMAGE_MAX_SIDE'] = int(os.getenv('IMAGE_MAX_SIDE', 1536))  # Longest side sent upstream, in pixels
+app.config['IMAGE_JPEG_QUALITY'] = int(os.getenv('IMAGE_JPEG_QUALITY', 90))
+app.config['RATE_LIMIT_SECONDS'] = float(os.getenv('RATE_LIMIT_SECONDS', 300))  # 5 minutes (300 seconds) between API calls, 0 disables
+app.config['RATE_LIMIT_BURST'] = int(os.getenv('RATE_LIMIT_BURST', 1))  # Calls allowed back to back before throttling
+app.config['RATE_LIMIT_MAX_WAIT'] = float(os.getenv('RATE_LIMIT_MAX_WAIT', 0))  # Seconds to queue before answering 429
+app.config['RATE_LIMIT_STATE_FILE'] = os.getenv('RATE_LIMIT_STATE_FILE', 'rate_limit_state.json')  # Runtime state, untracked
+app.config['MEMORY_CACHE_MAX_BYTES'] = int(os.getenv('MEMORY_CACHE_MAX_BYTES', 64 * 1024 * 1024))  # 64MB in-memory tier
+
+# Structured JSON logs, plus per-stage request timings when TRACE_ENABLED is set; configured before
+# the caches and queues below so their startup messages are logged too
+app.config['LOG_LEVEL'] = os.getenv('LOG_LEVEL', 'INFO')  # DEBUG also logs upstream response bodies
+app.config['LOG_PATH'] = os.getenv('LOG_PATH', '')  # stdout when empty
+app.config['TRACE_ENABLED'] = os.getenv('TRACE_ENABLED', '0').lower() in ('1', 'true', 'yes')
+tracing.configure(app.config['TRACE_ENABLED'], app.config['LOG_LEVEL'], app.config['LOG_PATH'] or None)
+
+# Disk quotas enforced by the janitor (bytes, file count, TTL seconds; 0 disables a limit)
+app.config['CACHE_QUOTA'] = default_quota('CACHE', 2 * 1024 ** 3, 100000, 30 * 24 * 3600)
+app.config['RESULT_QUOTA'] = default_quota('RESULTS', 1024 ** 3, 0, 24 * 3600)
+app.config['UPLOAD_QUOTA'] = default_quota('UPLOADS', 1024 ** 3, 0, 3600)
+app.config['CACHE_EVICTION_POLICY'] = os.getenv('CACHE_EVICTION_POLICY', 'lru')  # 'lru' or 'lfu'
+app.config['JANITOR_INTERVAL_SECONDS'] = int(os.getenv('JANITOR_INTERVAL_SECONDS', 900))  # 0 to run it from cron instead
+
+# Metadata index for the disk cache (kept out of static/ so it is never served)
+app.config['CACHE_INDEX_PATH'] = os.getenv('CACHE_INDEX_PATH', 'cache_index.db')
+
+# In-memory LRU tier in front of the disk cache
+MEMORY_CACHE = MemoryCache(app.config['MEMORY_CACHE_MAX_BYTES'])
+
+# Rebuilt from the cache folder whenever the index file is missing
+CACHE_INDEX = CacheIndex(app.config['CACHE_INDEX_PATH'], app.config['CACHE_FOLDER'])
+
+# Optional near-duplicate lookup by perceptual hash, stored alongside the cache index
+app.config['PHASH_ENABLED'] = os.getenv('PHASH_ENABLED', '0').lower() in ('1', 'true', 'yes')
+app.config['PHASH_THRESHOLD'] = int(os.getenv('PHASH_THRESHOLD', 4))  # Max differing bits per image, up to 7
+PERCEPTUAL_INDEX = (PerceptualIndex(app.config['CACHE_INDEX_PATH'], app.config['PHASH_THRESHOLD'])
+                    if app.config['PHASH_ENABLED'] else None)
+
+# Background sweeps of the static folders
+if app.config['JANITOR_INTERVAL_SECONDS'] > 0:
+    start_janitor(app.config, app.config['JANITOR_INTERVAL_SECONDS'], index=CACHE_INDEX)
+
+# Coalesce identical in-flight upstream calls across threads and workers
+app.config['SINGLE_FLIGHT_LOCK_TIMEOUT'] = float(os.getenv('SINGLE_FLIGHT_LOCK_TIMEOUT', 120))
+SINGLE_FLIGHT = SingleFlight(os.path.join(CACHE_FOLDER, '.locks'), app.config['SINGLE_FLIGHT_LOCK_TIMEOUT'])
+
+# Background job pool for async try-ons; job records are shared by all workers
+app.config['JOB_WORKERS'] = int(os.getenv('JOB_WORKERS', 4))
+app.config['JOB_QUEUE_MAX'] = int(os.getenv('JOB_QUEUE_MAX', 100))
+app.config['JOB_TTL_SECONDS'] = int(os.getenv('JOB_TTL_SECONDS', 3600))
+app.config['JOB_DB_PATH'] = os.getenv('JOB_DB_PATH', 'jobs.db')
+app.config['SSE_POLL_INTERVAL'] = float(os.getenv('SSE_POLL_INTERVAL', 0.25))
+app.config['SSE_MAX_SECONDS'] = int(os.getenv('SSE_MAX_SECONDS', 600))  # Longest a single event stream stays open
+app.config['BATCH_MAX_GARMENTS'] = int(os.getenv('BATCH_MAX_GARMENTS', 50))
+app.config['BATCH_CONCURRENCY'] = int(os.getenv('BATCH_CONCURRENCY', 4))  # Parallel upstream calls per batch
+JOB_STORE = JobStore(app.config['JOB_DB_PATH'])
+JOB_QUEUE = JobQueue(JOB_STORE, workers=app.config['JOB_WORKERS'],
+                     max_queue=app.config['JOB_QUEUE_MAX'], ttl_seconds=app.config['JOB_TTL_SECONDS'])
+
+# Traffic capture for replay.py: one JSON line per try-on request (opt-in)
+app.config['CAPTURE_ENABLED'] = os.getenv('CAPTURE_ENABLED', '0').lower() in ('1', 'true', 'yes')
+app.config['CAPTURE_PATH'] = os.getenv('CAPTURE_PATH', 'requests.jsonl')
+CAPTURE = TrafficCapture(app.config['CAPTURE_PATH']) if app.config['CAPTURE_ENABLED'] else None
 
 # API Keys
 RAPIDAPI_KEY = os.getenv('RAPIDAPI_KEY', "1d382b59c4msh374d1f543891f32p106b59jsn93ae938cf161")
 RAPIDAPI_HOST = "virtual-try-on2.p.rapidapi.com"
-
-# Cache for API calls
-LAST_API_CALL_TIME = 0
+RAPIDAPI_BASE_URL = os.getenv('RAPIDAPI_BASE_URL', f"https://{RAPIDAPI_HOST}")
+
+# Upstream connection pool and timeouts (seconds)
+app.config['UPSTREAM_POOL_SIZE'] = int(os.getenv('UPSTREAM_POOL_SIZE', 10))
+app.config['UPSTREAM_CONNECT_TIMEOUT'] = float(os.getenv('UPSTREAM_CONNECT_TIMEOUT', 5))
+app.config['UPSTREAM_READ_TIMEOUT'] = float(os.getenv('UPSTREAM_READ_TIMEOUT', 60))
+app.config['ASYNC_MAX_CONNECTIONS'] = int(os.getenv('ASYNC_MAX_CONNECTIONS', 200))  # asgi.py upstream connections per process
+app.config['ASGI_WSGI_THREADS'] = int(os.getenv('ASGI_WSGI_THREADS', 64))  # asgi.py threads for Flask routes, incl. open event streams
+
+# Stop calling a failing upstream for a while, and remember rejected inputs briefly
+app.config['CIRCUIT_FAILURE_THRESHOLD'] = int(os.getenv('CIRCUIT_FAILURE_THRESHOLD', 5))  # Consecutive failures
+app.config['CIRCUIT_RESET_SECONDS'] = float(os.getenv('CIRCUIT_RESET_SECONDS', 30))  # Open time before a trial call
+app.config['NEGATIVE_CACHE_TTL'] = int(os.getenv('NEGATIVE_CACHE_TTL', 300))
+CIRCUIT = CircuitBreaker(app.config['CIRCUIT_FAILURE_THRESHOLD'], app.config['CIRCUIT_RESET_SECONDS'])
+NEGATIVE_CACHE = NegativeCache(app.config['NEGATIVE_CACHE_TTL'])
+
+UPSTREAM = UpstreamClient(RAPIDAPI_BASE_URL, RAPIDAPI_KEY, RAPIDAPI_HOST,
+                          pool_size=app.config['UPSTREAM_POOL_SIZE'],
+                          connect_timeout=app.config['UPSTREAM_CONNECT_TIMEOUT'],
+                          read_timeout=app.config['UPSTREAM_READ_TIMEOUT'],
+                          breaker=CIRCUIT)
+
+# Hedged upstream calls: race Method 2 once Method 1 is slower than its recent p95 (opt-in)
+app.config['HEDGE_ENABLED'] = os.getenv('HEDGE_ENABLED', '0').lower() in ('1', 'true', 'yes')
+app.config['HEDGE_PERCENTILE'] = float(os.getenv('HEDGE_PERCENTILE', 95))
+app.config['HEDGE_DELAY_SECONDS'] = float(os.getenv('HEDGE_DELAY_SECONDS', 10))  # Until enough latencies are recorded
+app.config['HEDGE_WORKERS'] = int(os.getenv('HEDGE_WORKERS', 8))
+HEDGER = Hedger(app.config['HEDGE_PERCENTILE'], app.config['HEDGE_DELAY_SECONDS'])
+HEDGE_POOL = ThreadPoolExecutor(max_workers=app.config['HEDGE_WORKERS'], thread_name_prefix='hedge')
+
+# Upstream rate limit shared by every worker through the state file
+RATE_LIMITER = TokenBucket(app.config['RATE_LIMIT_STATE_FILE'],
+                           1 / app.config['RATE_LIMIT_SECONDS'] if app.config['RATE_LIMIT_SECONDS'] > 0 else 0,
+                           app.config['RATE_LIMIT_BURST'])
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
@@ -54,289 +177,851 @@ def index():
     return render_template('index.html')
 
 @app.route('/try-on', methods=['POST'])
+@tracing.traced('try_on')
+@metrics.IN_FLIGHT.labels('try_on').track_inprogress()
+@metrics.REQUEST_LATENCY.labels('try_on').time()
 def try_on():
-    # Check if both files are present
-    if 'model_image' not in request.files or 'garment_image' not in request.files:
-        flash('Both model and garment images are required')
-        return redirect(request.url)
+    # Async clients get a job id back instead of waiting on the upstream call
+    async_mode = request.values.get('async', '').lower() in ('1', 'true', 'yes')
 
-    model_file = request.files['model_image']
-    garment_file = request.files['garment_image']
-
-    # Check if files are selected
-    if model_file.filename == '' or garment_file.filename == '':
-        flash('No file selected')
-        return redirect(request.url)
-
-    # Check if files are allowed
-    if not (allowed_file(model_file.filename) and allowed_file(garment_file.filename)):
-        flash('Invalid file type. Only PNG, JPG, and JPEG are allowed')
+    try:
+        upload_started = time.time()
+        with tracing.span('upload'):
+            model_image, garment_image = save_uploads()
+        upload_ms = (time.time() - upload_started) * 1000
+    except ValueError as e:
+        if async_mode:
+            return jsonify(error=str(e)), 400
+        flash(str(e))
         return redirect(request.url)
 
-    # Save uploaded files
-    model_filename = secure_filename(f"{uuid.uuid4()}_{model_file.filename}")
-    garment_filename = secure_filename(f"{uuid.uuid4()}_{garment_file.filename}")
-
-    model_path = os.path.join(app.config['UPLOAD_FOLDER'], model_filename)
-    garment_path = os.path.join(app.config['UPLOAD_FOLDER'], garment_filename)
-
-    model_file.save(model_path)
-    garment_file.save(garment_path)
-
     # Get category from form (not used by RapidAPI but kept for future use)
     category = request.form.get('category', 'Upper body')
 
+    capture = None
+    if CAPTURE is not None:
+        capture = CAPTURE.start(model_image, garment_image, category, 'async' if async_mode else 'sync', upload_ms)
+
+    if async_mode:
+        try:
+            job_id = JOB_QUEUE.submit('try-on', run_tryon_job, model_image, garment_image, category,
+                                      upload_ms=upload_ms, capture=capture)
+        except QueueFull as e:
+            if capture is not None:
+                CAPTURE.write(capture, 503)
+            return jsonify(error=str(e)), 503, {'Retry-After': '5'}
+        return jsonify(job_id=job_id, status_url=url_for('job_status', job_id=job_id),
+                       events_url=url_for('job_events', job_id=job_id)), 202
+
+    model_path = model_image.path
+    garment_path = garment_image.path
+    # Written with the response status by write_capture()
+    g.capture = capture
+
     try:
         # Call the RapidAPI Virtual Try-On API
-        print(f"Calling API with model_path={model_path}, garment_path={garment_path}")
-        result_path = call_rapidapi_tryon(model_path, garment_path, category)
-
-        # Verify the result file exists and has content
-        if not os.path.exists(result_path) or os.path.getsize(result_path) == 0:
-            raise Exception("API returned an empty or invalid result")
+        tracing.log('tryon_started', model_path=model_path, garment_path=garment_path, category=category)
+        result_path = call_rapidapi_tryon(model_path, garment_path, category,
+                                          model_image=model_image, garment_image=garment_image,
+                                          progress=CAPTURE.progress(capture) if capture is not None else None)
+        verify_result(result_path)
 
-        print(f"API call successful, result saved to {result_path}")
+        tracing.log('tryon_succeeded', result_path=result_path)
 
         # Return the result page
-        return render_template('result.html',
-                              original_model=model_path.replace('\\', '/'),
-                              original_garment=garment_path.replace('\\', '/'),
-                              result_image=result_path.replace('\\', '/'))
+        with tracing.span('render'):
+            return render_template('result.html',
+                                  original_model=model_path.replace('\\', '/'),
+                                  original_garment=garment_path.replace('\\', '/'),
+                                  result_image=result_path.replace('\\', '/'))
+
+    except RateLimitExceeded as e:
+        tracing.warning('rate_limited', retry_after=e.retry_after)
+        flash(f'Too many try-on requests. Please try again in {math.ceil(e.retry_after)} seconds.')
+        return render_template('index.html'), 429, {'Retry-After': str(math.ceil(e.retry_after))}
+
+    except CircuitOpen as e:
+        tracing.warning('circuit_open', retry_after=e.retry_after)
+        flash(f'{str(e)}.')
+        return render_template('index.html'), 503, {'Retry-After': str(math.ceil(e.retry_after))}
 
     except Exception as e:
-        import traceback
-        error_details = traceback.format_exc()
-        print(f"Error in try-on route: {str(e)}")
-        print(error_details)
+        tracing.error('tryon_failed', exc_info=True, error=str(e))
         flash(f'Error: {str(e)}')
         return redirect(url_for('index'))
 
-def generate_cache_key(model_path, garment_path, category):
-    """Generate a unique cache key based on input parameters"""
-    # Read image data
-    with open(model_path, 'rb') as f:
-        model_data = f.read()
-    with open(garment_path, 'rb') as f:
-        garment_data = f.read()
+def save_uploads(files=None):
+    """Validate and save the model and garment uploads, raising ValueError with a user-facing message"""
+    # Callers outside a Flask request (the ASGI route) pass their parsed files in
+    if files is None:
+        files = request.files
 
-    # Create a hash of the combined data
-    combined = model_data + garment_data + category.encode('utf-8')
-    return hashlib.md5(combined).hexdigest()
-
-def check_cache(cache_key):
-    """Check if a result exists in the cache"""
-    cache_file = os.path.join(app.config['CACHE_FOLDER'], f"{cache_key}.jpg")
-    if os.path.exists(cache_file):
-        return cache_file
-    return None
-
-def save_to_cache(cache_key, image_data):
-    """Save result to cache"""
-    cache_file = os.path.join(app.config['CACHE_FOLDER'], f"{cache_key}.jpg")
-    with open(cache_file, 'wb') as f:
-        f.write(image_data)
-    return cache_file
-
-def call_rapidapi_tryon(model_path, garment_path, category=None):
-    """Call the RapidAPI Virtual Try-On API with caching"""
-    import http.client
-
-    # Generate a cache key for this request
-    cache_key = generate_cache_key(model_path, garment_path, str(category))
-
-    # Check if result is in cache
-    cached_result = check_cache(cache_key)
-    if cached_result:
-        print("Using cached result")
-        # Copy the cached result to the results folder for consistency
-        result_filename = f"result_{uuid.uuid4()}.jpg"
-        result_path = os.path.join(app.config['RESULT_FOLDER'], result_filename)
-        with open(cached_result, 'rb') as src, open(result_path, 'wb') as dst:
-            dst.write(src.read())
-        return result_path
-
-    # Read the image files
-    with open(model_path, 'rb') as f:
-        model_image_data = f.read()
-
-    with open(garment_path, 'rb') as f:
-        garment_image_data = f.read()
-
-    # Method 1: Using requests library with multipart/form-data
-    import requests
-
-    url = "https://virtual-try-on2.p.rapidapi.com/clothes-virtual-tryon"
+    # Check if both files are present
+    if 'model_image' not in files or 'garment_image' not in files:
+        raise ValueError('Both model and garment images are required')
 
-    files = {
-        'personImage': ('person.jpg', model_image_data, 'image/jpeg'),
-        'clothImage': ('garment.jpg', garment_image_data, 'image/jpeg')
-    }
+    model_file = files['model_image']
+    garment_file = files['garment_image']
 
-    headers = {
-        'x-rapidapi-key': RAPIDAPI_KEY,
-        'x-rapidapi-host': RAPIDAPI_HOST
-    }
+    # Check if files are selected
+    if model_file.filename == '' or garment_file.filename == '':
+        raise ValueError('No file selected')
 
+    # Check if files are allowed
+    if not (allowed_file(model_file.filename) and allowed_file(garment_file.filename)):
+        raise ValueError('Invalid file type. Only PNG, JPG, and JPEG are allowed')
+
+    return save_upload(model_file), save_upload(garment_file)
+
+def save_upload(file_storage):
+    """Hash one upload and store it under its digest, so it is never re-read from disk"""
+    # Normalized uploads are always stored as JPEG
+    ext = 'jpg' if app.config['IMAGE_NORMALIZE'] else file_storage.filename.rsplit('.', 1)[1].lower()
+    return save_and_hash(file_storage, ext)
+
+def verify_result(result_path):
+    """Verify the result file exists and has content"""
+    if not result_path.startswith(CACHE_ROUTE_PREFIX) and \
+            (not os.path.exists(result_path) or os.path.getsize(result_path) == 0):
+        raise Exception("API returned an empty or invalid result")
+
+def result_url(result_path):
+    """Turn a result path into the URL the browser fetches it from"""
+    return '/' + result_path.replace('\\', '/')
+
+def job_progress(job_id, **context):
+    """Progress callback that records stage events against a job"""
+    return lambda stage, **data: JOB_STORE.add_event(job_id, stage, **context, **data)
+
+@tracing.traced('tryon_job')
+@metrics.IN_FLIGHT.labels('tryon_job').track_inprogress()
+@metrics.REQUEST_LATENCY.labels('tryon_job').time()
+def run_tryon_job(job_id, model_image, garment_image, category, upload_ms=None, capture=None):
+    """Background job body for an async try-on"""
+    progress = job_progress(job_id)
+    if capture is not None:
+        progress = CAPTURE.progress(capture, progress)
+    report(progress, 'uploaded', bytes=len(model_image.data) + len(garment_image.data), latency_ms=upload_ms)
+    status = 500
     try:
-        response = requests.post(url, files=files, headers=headers)
-
-        if response.status_code != 200:
-            # If the first method fails, try the alternative method
-            print(f"Method 1 failed with status code {response.status_code}. Trying Method 2...")
-            return call_rapidapi_tryon_alt(model_path, garment_path)
-
-        # Check if the response is JSON
-        content_type = response.headers.get('Content-Type', '')
-        print(f"Response content type: {content_type}")
-        print(f"Response content (first 200 chars): {response.text[:200]}")
-
+        result_path = call_rapidapi_tryon(model_image.path, garment_image.path, category,
+                                          model_image=model_image, garment_image=garment_image,
+                                          progress=progress)
+        verify_result(result_path)
+        status = 200
+        return {'result_url': result_url(result_path)}
+    finally:
+        if capture is not None:
+            CAPTURE.write(capture, status)
+
+@app.after_request
+def write_capture(response):
+    """Append a finished synchronous try-on to the traffic capture"""
+    capture = g.pop('capture', None)
+    if capture is not None:
+        CAPTURE.write(capture, response.status_code)
+    return response
+
+@app.route('/try-on/batch', methods=['POST'])
+def try_on_batch():
+    """Try one model image against many garments; returns a job whose result fills in as garments finish"""
+    model_file = request.files.get('model_image')
+    if model_file is None or model_file.filename == '' or not allowed_file(model_file.filename):
+        return jsonify(error='A PNG, JPG or JPEG model image is required'), 400
+
+    garment_files = [f for f in request.files.getlist('garment_images') if f.filename != '']
+    garment_ids = [secure_filename(g) for g in request.form.getlist('garment_ids') if g.strip()]
+    if not garment_files and not garment_ids:
+        return jsonify(error='At least one garment image or garment id is required'), 400
+    if len(garment_files) + len(garment_ids) > app.config['BATCH_MAX_GARMENTS']:
+        return jsonify(error=f"At most {app.config['BATCH_MAX_GARMENTS']} garments per batch"), 400
+    if not all(allowed_file(f.filename) for f in garment_files):
+        return jsonify(error='Invalid file type. Only PNG, JPG, and JPEG are allowed'), 400
+
+    # Catalog garments are looked up by id in the garment folder
+    garments = []
+    for garment_id in garment_ids:
+        garment_path = find_catalog_garment(garment_id)
+        if garment_path is None:
+            return jsonify(error=f'Unknown garment id: {garment_id}'), 400
         try:
-            # Try to parse as JSON
-            json_response = response.json()
-            print(f"JSON response: {json_response}")
+            garments.append((garment_id, read_and_hash(garment_path)))
+        except ValueError as e:
+            return jsonify(error=f'Garment {garment_id}: {str(e)}'), 400
 
-            # Check if the JSON contains a URL to the result image
-            if json_response.get('success') and 'response' in json_response and 'ouput_path_img' in json_response['response']:
-                # Get the image URL from the JSON response
-                image_url = json_response['response']['ouput_path_img']
-                print(f"Image URL from API: {image_url}")
-
-                # Download the image from the URL
-                img_response = requests.get(image_url)
-                if img_response.status_code != 200:
-                    print(f"Failed to download image from URL: {img_response.status_code}")
-                    return call_rapidapi_tryon_alt(model_path, garment_path)
-
-                # Save the result image
-                result_filename = f"result_{uuid.uuid4()}.jpg"
-                result_path = os.path.join(app.config['RESULT_FOLDER'], result_filename)
-
-                # Save the image content
-                with open(result_path, 'wb') as f:
-                    f.write(img_response.content)
+    # The model is saved and hashed once for the whole batch
+    upload_started = time.time()
+    try:
+        model_image = save_upload(model_file)
+        garments.extend((f.filename, save_upload(f)) for f in garment_files)
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+    upload_ms = (time.time() - upload_started) * 1000
+    category = request.form.get('category', 'Upper body')
 
-                # Save to cache
-                save_to_cache(cache_key, img_response.content)
+    try:
+        job_id = JOB_QUEUE.submit('batch', run_batch_job, model_image, garments, category, upload_ms=upload_ms)
+    except QueueFull as e:
+        return jsonify(error=str(e)), 503, {'Retry-After': '5'}
+    return jsonify(job_id=job_id, status_url=url_for('job_status', job_id=job_id),
+                   events_url=url_for('job_events', job_id=job_id)), 202
+
+def find_catalog_garment(garment_id):
+    """Return the path of a catalog garment image, or None"""
+    for ext in sorted(ALLOWED_EXTENSIONS):
+        path = os.path.join(app.config['GARMENT_FOLDER'], f"{garment_id}.{ext}")
+        if os.path.exists(path):
+            return path
+    return None
 
-                return result_path
-            else:
-                print("JSON response does not contain expected image URL")
-                return call_rapidapi_tryon_alt(model_path, garment_path)
-        except ValueError:
-            # If not JSON, check if it's an image directly
-            if 'image' in content_type:
-                # Save the result image
-                result_filename = f"result_{uuid.uuid4()}.jpg"
-                result_path = os.path.join(app.config['RESULT_FOLDER'], result_filename)
-
-                # Save the response content
-                with open(result_path, 'wb') as f:
-                    f.write(response.content)
-
-                # Save to cache
-                save_to_cache(cache_key, response.content)
+@tracing.traced('batch_job')
+@metrics.IN_FLIGHT.labels('batch_job').track_inprogress()
+@metrics.REQUEST_LATENCY.labels('batch_job').time()
+def run_batch_job(job_id, model_image, garments, category, upload_ms=None):
+    """Background job body for a batch: serve cache hits in one pass, then fan out the misses"""
+    items = [{'garment': name, 'status': 'pending'} for name, _ in garments]
+    lock = threading.Lock()
+    report(job_progress(job_id), 'uploaded', garments=len(garments),
+           bytes=len(model_image.data) + sum(len(g.data) for _, g in garments), latency_ms=upload_ms)
+
+    def publish():
+        JOB_STORE.update(job_id, result={'items': items, 'total': len(items),
+                                         'completed': sum(item['status'] != 'pending' for item in items)})
+
+    # One pass over the cache before anything goes upstream
+    misses = []
+    for item, (_, garment_image) in zip(items, garments):
+        cache_key = generate_cache_key(model_image.digest, garment_image.digest, str(category))
+        cached = reference_cached_result(cache_key, count=True)
+        if cached is not None:
+            item.update(status='done', cached=True, result_url=result_url(cached))
+            report(job_progress(job_id, garment=item['garment']), 'cache_hit', cache_key=cache_key)
+        else:
+            misses.append((item, garment_image))
+    publish()
+
+    def run_one(item, garment_image):
+        try:
+            result_path = call_rapidapi_tryon(model_image.path, garment_image.path, category,
+                                              model_image=model_image, garment_image=garment_image,
+                                              progress=job_progress(job_id, garment=item['garment']),
+                                              count_lookup=False)
+            verify_result(result_path)
+            update = {'status': 'done', 'cached': False, 'result_url': result_url(result_path)}
+        except Exception as e:
+            update = {'status': 'failed', 'error': str(e)}
+        with lock:
+            item.update(update)
+            publish()
+
+    if misses:
+        with ThreadPoolExecutor(max_workers=min(app.config['BATCH_CONCURRENCY'], len(misses)),
+                                thread_name_prefix='tryon-batch') as pool:
+            for item, garment_image in misses:
+                pool.submit(tracing.bind(run_one), item, garment_image)
+
+    return {'items': items, 'total': len(items), 'completed': len(items)}
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    """Report a job's status, timings and, once done, its result URL"""
+    job = JOB_STORE.get(job_id)
+    if job is None:
+        return jsonify(error='Unknown job'), 404
+    return jsonify(job)
+
+@app.route('/jobs/<job_id>/events')
+def job_events(job_id):
+    """Stream a job's stage events as Server-Sent Events until it finishes"""
+    if JOB_STORE.get(job_id) is None:
+        return jsonify(error='Unknown job'), 404
+
+    # Resume after the last event a reconnecting client saw
+    last_id = request.headers.get('Last-Event-ID', request.args.get('after', '0'))
+    last_id = int(last_id) if last_id.isdigit() else 0
+
+    def stream():
+        nonlocal last_id
+        deadline = time.time() + app.config['SSE_MAX_SECONDS']
+        last_sent = time.time()
+        while time.time() < deadline:
+            job = JOB_STORE.get(job_id)
+            for event in JOB_STORE.events_since(job_id, last_id):
+                last_id = event['id']
+                event['elapsed_ms'] = (event['ts'] - job['created']) * 1000
+                last_sent = time.time()
+                yield f"id: {last_id}\nevent: {event['stage']}\ndata: {json.dumps(event)}\n\n"
+            if job['status'] in ('done', 'failed'):
+                yield f"event: {job['status']}\ndata: {json.dumps(job)}\n\n"
+                return
+            if time.time() - last_sent > 15:
+                # Comment line keeps proxies from closing an idle stream
+                last_sent = time.time()
+                yield ": keep-alive\n\n"
+            time.sleep(app.config['SSE_POLL_INTERVAL'])
+
+    return Response(stream_with_context(stream()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/jobs')
+def job_stats():
+    """Report this worker's queue depth and timings, and job counts across all workers"""
+    return jsonify(worker=JOB_QUEUE.stats(), jobs=JOB_STORE.counts())
+
+@app.route('/cache/stats')
+def cache_stats():
+    """Report disk index and memory tier statistics, the upstream circuit state and per-method latencies"""
+    return jsonify(disk=CACHE_INDEX.stats(), memory=MEMORY_CACHE.stats(), circuit=CIRCUIT.stats(),
+                   upstream=HEDGER.stats())
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """Prometheus metrics for the try-on pipeline, merged across gunicorn workers"""
+    return Response(metrics.render(folder_usage()), content_type=metrics.CONTENT_TYPE_LATEST)
+
+def folder_usage():
+    """Bytes and file counts of the upload, result and cache folders"""
+    usage = {}
+    for folder in (app.config['UPLOAD_FOLDER'], app.config['RESULT_FOLDER']):
+        entries = scan_folder(folder, 'expire')
+        usage[folder] = (sum(entry.size for entry in entries), len(entries))
+    # The index keeps running totals, so the sharded cache tree is not walked on every scrape
+    disk = CACHE_INDEX.stats()
+    usage[app.config['CACHE_FOLDER']] = (disk['bytes'], disk['entries'])
+    return usage
+
+@app.route('/cache/<cache_key>.jpg')
+def cached_result(cache_key):
+    """Stream a cached result from the memory tier or the disk cache"""
+    if not all(c in '0123456789abcdef' for c in cache_key):
+        abort(404)
+    image_data = load_from_cache(cache_key)
+    if image_data is None:
+        abort(404)
+    return send_file(io.BytesIO(image_data), mimetype='image/jpeg', max_age=86400)
+
+def save_and_hash(file_storage, ext):
+    """Read an upload in chunks, hashing it on the way, and store it content-addressed"""
+    hasher = hashlib.blake2b(digest_size=16)
+    chunks = []
+    with tracing.span('read'):
+        while True:
+            chunk = file_storage.stream.read(HASH_CHUNK_SIZE)
+            if not chunk:
+                break
+            chunks.append(chunk)
+            if not app.config['IMAGE_NORMALIZE']:
+                hasher.update(chunk)
+        data = b''.join(chunks)
+
+    if app.config['IMAGE_NORMALIZE']:
+        # The normalized bytes are what gets hashed, stored and sent upstream
+        with tracing.span('normalize'):
+            data = normalize_upload(data)
+        with tracing.span('hash'):
+            hasher.update(data)
+
+    digest = hasher.hexdigest()
+    with tracing.span('file_save'):
+        path = store_upload(digest, ext, data)
+    return HashedImage(path, digest, data)
+
+def store_upload(digest, ext, data):
+    """Write an upload as <digest>.<ext> unless it is already stored; return its path"""
+    path = os.path.join(app.config['UPLOAD_FOLDER'], f"{digest}.{ext}")
+    try:
+        # Already stored: refresh its age so the janitor's TTL counts from the latest upload
+        os.utime(path)
+    except FileNotFoundError:
+        write_atomic(path, data)
+    return path
+
+def read_and_hash(path):
+    """Read an image from disk once and hash it"""
+    with open(path, 'rb') as f:
+        data = f.read()
+    if app.config['IMAGE_NORMALIZE']:
+        data = normalize_upload(data)
+    return HashedImage(path, hashlib.blake2b(data, digest_size=16).hexdigest(), data)
+
+def normalize_upload(data):
+    """Orient, downscale and re-encode an image with the configured limits"""
+    return normalize_image(data, app.config['IMAGE_MAX_SIDE'], app.config['IMAGE_JPEG_QUALITY'])
+
+def generate_cache_key(model_digest, garment_digest, category):
+    """Generate a unique cache key from the image digests and category"""
+    key = f"{model_digest}:{garment_digest}:{category}"
+    return hashlib.blake2b(key.encode('utf-8'), digest_size=16).hexdigest()
 
-                return result_path
-            else:
-                print("Response is neither JSON nor image")
-                return call_rapidapi_tryon_alt(model_path, garment_path)
+def check_cache(cache_key):
+    """Check if a result exists in the cache"""
+    entry = CACHE_INDEX.lookup(cache_key)
+    if entry is not None and not os.path.exists(entry.path):
+        # Removed behind the index's back
+        CACHE_INDEX.remove(cache_key)
+        entry = None
+    if entry is None:
+        return None
+    CACHE_INDEX.record_hit(cache_key)
+    return entry.path
+
+def load_from_cache(cache_key):
+    """Return cached result bytes, trying the memory tier before the disk cache"""
+    image_data = MEMORY_CACHE.get(cache_key)
+    if image_data is not None:
+        return image_data
+
+    cache_file = check_cache(cache_key)
+    if cache_file is None:
+        return None
+    with open(cache_file, 'rb') as f:
+        image_data = f.read()
+    MEMORY_CACHE.put(cache_key, image_data)
+    return image_data
+
+def reference_cached_result(cache_key, count=False):
+    """Point a new result at a cached entry without copying its bytes; count=True records the lookup in metrics"""
+    # Hot results are served from the memory tier through the cache route, without touching the disk
+    image_data = MEMORY_CACHE.get(cache_key)
+    # The disk entry must still be the one held in memory: another worker may answer the browser's GET from
+    # disk, and an evicted or replaced entry must not live on here. The hit also keeps the janitor off a hot key
+    in_memory = image_data is not None and CACHE_INDEX.record_hit(cache_key, size=len(image_data))
+    if image_data is not None and not in_memory:
+        MEMORY_CACHE.discard(cache_key)
+    if count:
+        metrics.cache_lookup('memory', in_memory)
+    if in_memory:
+        return f"{CACHE_ROUTE_PREFIX}{cache_key}.jpg"
+
+    cache_file = check_cache(cache_key)
+    if count:
+        metrics.cache_lookup('disk', cache_file is not None)
+    if cache_file is None:
+        return None
+    warm_memory_cache(cache_key, cache_file)
+    return link_result(cache_key, cache_file)
+
+def warm_memory_cache(cache_key, cache_file):
+    """Load a disk hit into the memory tier so the next hit on the key is served from memory"""
+    try:
+        if os.path.getsize(cache_file) > MEMORY_CACHE.max_bytes:
+            return
+        with open(cache_file, 'rb') as f:
+            MEMORY_CACHE.put(cache_key, f.read())
+    except FileNotFoundError:
+        pass
+
+def link_result(cache_key, cache_file):
+    """Give a cache entry its own result path: a hardlink, else a symlink, else the cache route"""
+    result_filename = f"result_{uuid.uuid4()}.jpg"
+    result_path = os.path.join(app.config['RESULT_FOLDER'], result_filename)
 
+    try:
+        os.link(cache_file, result_path)
         return result_path
-    except Exception as e:
-        print(f"Method 1 failed with error: {str(e)}. Trying Method 2...")
-        return call_rapidapi_tryon_alt(model_path, garment_path)
-
-def call_rapidapi_tryon_alt(model_path, garment_path):
-    """Alternative method to call the RapidAPI Virtual Try-On API using http.client"""
-    import http.client
+    except OSError:
+        pass
+    try:
+        os.symlink(os.path.relpath(cache_file, app.config['RESULT_FOLDER']), result_path)
+        return result_path
+    except OSError:
+        pass
+    return f"{CACHE_ROUTE_PREFIX}{cache_key}.jpg"
+
+def cache_file_path(cache_key):
+    """Return the sharded location of a cache entry, e.g. static/cache/ab/cd/abcd....jpg"""
+    return os.path.join(app.config['CACHE_FOLDER'], cache_key[:2], cache_key[2:4], f"{cache_key}.jpg")
+
+def write_atomic(path, data):
+    """Write a file via a hidden temp file and rename, so readers never see a partial image"""
+    return write_atomic_chunks(path, (data,))
+
+def write_atomic_chunks(path, chunks, replace=True):
+    """write_atomic for data arriving in pieces, e.g. a streamed download; returns the bytes written
+
+    With replace=False an existing file at path is left alone and FileExistsError is raised.
+    """
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(prefix='.', suffix='.tmp', dir=directory)
+    size = 0
+    try:
+        # mkstemp creates 0600 files; static files must stay readable by a fronting web server
+        os.chmod(tmp_path, 0o644)
+        with os.fdopen(fd, 'wb') as f:
+            for chunk in chunks:
+                f.write(chunk)
+                size += len(chunk)
+            f.flush()
+            os.fsync(f.fileno())
+        if replace:
+            os.replace(tmp_path, path)
+        else:
+            promote_if_absent(tmp_path, path)
+        return size
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
 
-    # Read the image files
-    with open(model_path, 'rb') as f:
-        model_image_data = f.read()
+def promote_if_absent(tmp_path, path):
+    """Move a finished temp file to path unless something is already there, in which case raise FileExistsError"""
+    try:
+        # link() fails rather than overwrite, so two writers of one key cannot both win
+        os.link(tmp_path, path)
+    except FileExistsError:
+        raise
+    except OSError:
+        # No hardlinks on this filesystem; single-flight keeps other processes off the key, so only this
+        # process's hedge could race the check
+        if os.path.exists(path):
+            raise FileExistsError(path)
+        os.replace(tmp_path, path)
+        return
+    os.remove(tmp_path)
+
+def store_result(cache_key, chunks, started, method):
+    """Write an upstream result once, into the cache, and link it in as the result; returns (path, bytes)"""
+    cache_file = cache_file_path(cache_key)
+    try:
+        with tracing.span('result_write', method=method):
+            size = write_atomic_chunks(cache_file, chunks, replace=False)
+    except FileExistsError:
+        # The other half of a hedge stored this key first. Its bytes and index row stay: the request it
+        # answered, and every hit since, must keep getting the same image
+        tracing.log('cache_write_skipped', cache_key=cache_key, method=method)
+        size = os.path.getsize(cache_file)
+        # An unindexed file is either that call's, a moment before it indexes it (and overwrites this
+        # placeholder row), or a leftover that would otherwise never be served
+        CACHE_INDEX.add(cache_key, cache_file, size, method='unknown', replace=False)
+        return link_result(cache_key, cache_file), size
+    if size == 0:
+        # Not indexed yet, so nothing can have served it
+        os.remove(cache_file)
+        raise Exception("API returned an empty or invalid result")
+    metrics.RESULT_BYTES.inc(size)
+    # The memory tier fills on the key's first hit, so a streamed result is never held in memory here
+    with tracing.span('cache_write', method=method, bytes=size):
+        CACHE_INDEX.add(cache_key, cache_file, size, latency_ms=(time.time() - started) * 1000, method=method)
+        result_path = link_result(cache_key, cache_file)
+    return result_path, size
+
+def download_result(cache_key, image_url, started, method, progress=None):
+    """Stream a result image from the upstream's download URL into the cache; None if the download failed"""
+    download_started = time.time()
+    with tracing.span('download', method=method):
+        img_response = UPSTREAM.download(image_url, stream=True)
+    with img_response:
+        if img_response.status_code != 200:
+            report(progress, 'downloaded', method=method, status=img_response.status_code,
+                   latency_ms=(time.time() - download_started) * 1000)
+            tracing.warning('download_failed', method=method, status=img_response.status_code)
+            return None
+        # The body goes straight from the socket to the cache file, so this includes the write
+        result_path, size = store_result(cache_key, img_response.iter_content(DOWNLOAD_CHUNK_SIZE), started, method)
+    metrics.DOWNLOAD_BYTES.labels(method).observe(size)
+    report(progress, 'downloaded', method=method, status=img_response.status_code, bytes=size,
+           latency_ms=(time.time() - download_started) * 1000)
+    report(progress, 'stored', method=method, result_path=result_path)
+    return result_path
+
+def report(progress, stage, **data):
+    """Send a stage event to the progress callback, if there is one"""
+    if progress is not None:
+        progress(stage, **data)
+
+def call_rapidapi_tryon(model_path, garment_path, category=None, model_image=None, garment_image=None,
+                        progress=None, count_lookup=True):
+    """Call the RapidAPI Virtual Try-On API with caching; count_lookup=False if the caller already counted it"""
+    # Reuse the digests and bytes from the upload when the caller has them
+    if model_image is None:
+        model_image = read_and_hash(model_path)
+    if garment_image is None:
+        garment_image = read_and_hash(garment_path)
 
-    with open(garment_path, 'rb') as f:
-        garment_image_data = f.read()
+    # Generate a cache key for this request
+    cache_key = generate_cache_key(model_image.digest, garment_image.digest, str(category))
 
+    # Check if result is in cache
+    # Counted here only: the single-flight re-check and the browser's GET of a cache route are the same request
+    with tracing.span('cache_lookup'):
+        cached_result = reference_cached_result(cache_key, count=count_lookup)
+    if cached_result is not None:
+        tracing.log('cache_hit', cache_key=cache_key)
+        report(progress, 'cache_hit', cache_key=cache_key)
+        return cached_result
+
+    # Near-identical inputs (re-encoded, resized, stripped) can reuse an existing result
+    with tracing.span('phash_lookup'):
+        hashes, cached_result = near_duplicate_lookup(str(category), model_image, garment_image, progress)
+    if cached_result is not None:
+        return cached_result
+    report(progress, 'cache_miss', cache_key=cache_key)
+
+    # The upstream just rejected this exact pair; sending it again would only burn quota
+    rejection = NEGATIVE_CACHE.get(cache_key)
+    if rejection is not None:
+        raise UpstreamRejected(rejection)
+
+    # Identical concurrent requests share a single upstream call
+    result_path = SINGLE_FLIGHT.do(cache_key,
+                                   lambda: fetch_tryon_result(cache_key, model_image, garment_image, progress))
+
+    index_perceptual_hashes(cache_key, str(category), hashes)
+    return result_path
+
+def near_duplicate_lookup(category, model_image, garment_image, progress=None):
+    """Look for a cached result of near-identical inputs; returns (hashes, result_path), either may be None"""
+    hashes = perceptual_hashes(model_image, garment_image) if PERCEPTUAL_INDEX is not None else None
+    if hashes is None:
+        return None, None
+    near_key, distance, cached_result = find_near_duplicate(category, hashes)
+    metrics.cache_lookup('near_duplicate', cached_result is not None)
+    if cached_result is not None:
+        tracing.log('cache_hit', cache_key=near_key, near_duplicate=True, distance=distance)
+        report(progress, 'cache_hit', cache_key=near_key, near_duplicate=True, distance=distance)
+    return hashes, cached_result
+
+def index_perceptual_hashes(cache_key, category, hashes):
+    """Make a newly cached result findable by near-duplicate lookups"""
+    if hashes is not None and CACHE_INDEX.lookup(cache_key) is not None:
+        PERCEPTUAL_INDEX.add(cache_key, category, *hashes)
+
+def perceptual_hashes(model_image, garment_image):
+    """dHash both images, or None if either cannot be decoded"""
+    try:
+        return dhash(model_image.data), dhash(garment_image.data)
+    except Exception as e:
+        tracing.warning('phash_skipped', error=str(e))
+        return None
+
+def find_near_duplicate(category, hashes):
+    """Return (cache_key, distance, result_path) for the closest live near-duplicate, or Nones"""
+    for near_key, distance in PERCEPTUAL_INDEX.find(category, *hashes):
+        cached_result = reference_cached_result(near_key)
+        if cached_result is not None:
+            return near_key, distance, cached_result
+        # The cache entry was evicted; drop its stale perceptual row
+        PERCEPTUAL_INDEX.remove(near_key)
+    return None, None, None
+
+def fetch_tryon_result(cache_key, model_image, garment_image, progress=None):
+    """Call the upstream API for a cache miss, unless another worker filled the cache meanwhile"""
+    cached_result = reference_cached_result(cache_key)
+    if cached_result is not None:
+        tracing.log('cache_hit', cache_key=cache_key, concurrent=True)
+        report(progress, 'cache_hit', cache_key=cache_key, concurrent=True)
+        return cached_result
+
+    # Fail fast while the upstream is down, before spending a rate limit token
+    CIRCUIT.check()
+
+    # Queue briefly or fail fast rather than exceed our RapidAPI quota
+    with tracing.span('rate_limit_wait'):
+        RATE_LIMITER.acquire(app.config['RATE_LIMIT_MAX_WAIT'])
+
+    if app.config['HEDGE_ENABLED']:
+        return fetch_hedged(cache_key, model_image, garment_image, progress)
+
+    method = 'primary'
     try:
-        conn = http.client.HTTPSConnection("virtual-try-on2.p.rapidapi.com")
+        result_path = run_method('primary', call_rapidapi_tryon_primary, cache_key, model_image, garment_image,
+                                 progress)
+    except (CircuitOpen, UpstreamRejected):
+        raise
+    except Exception as e:
+        tracing.warning('method_failed', method='primary', error=str(e))
+        result_path = None
+
+    if result_path is None:
+        method = 'alt'
+        metrics.FALLBACKS.labels('sequential').inc()
+        result_path = run_method('alt', call_rapidapi_tryon_alt, cache_key, model_image, garment_image, progress)
+    HEDGER.record_win(method)
+    return result_path
+
+def run_method(method, fn, *args):
+    """Run one upstream method, recording its latency when it produces a result"""
+    started = time.time()
+    result_path = fn(*args)
+    if result_path is not None:
+        HEDGER.record(method, (time.time() - started) * 1000)
+    return result_path
+
+def fetch_hedged(cache_key, model_image, garment_image, progress=None):
+    """Race Method 2 against a slow Method 1 and serve whichever valid image arrives first"""
+    # Method 1 gets its own thread: queued behind other requests in HEDGE_POOL, it could outlast the hedge
+    # delay before it had even been sent
+    futures = {run_in_thread(tracing.bind(run_method), 'primary', call_rapidapi_tryon_primary, cache_key, model_image,
+                             garment_image, progress): 'primary'}
+
+    delay = HEDGER.delay('primary')
+    done, _ = wait(futures, timeout=delay)
+    if not done:
+        # A hedge is a second upstream call, so it only goes out if the rate limit has a token to spare
+        acquired, _ = RATE_LIMITER.try_acquire()
+        if acquired:
+            tracing.log('hedge_fired', delay_ms=delay * 1000)
+            HEDGER.record_hedge()
+            metrics.FALLBACKS.labels('hedged').inc()
+            report(progress, 'hedged', method='alt', delay_ms=delay * 1000)
+            futures[HEDGE_POOL.submit(tracing.bind(run_method), 'alt', call_rapidapi_tryon_alt, cache_key, model_image,
+                                      garment_image, progress)] = 'alt'
+
+    error = None
+    for future in as_completed(futures):
+        method = futures[future]
+        try:
+            result_path = future.result()
+            if result_path is None:
+                continue
+            verify_result(result_path)
+        except UpstreamRejected:
+            raise
+        except Exception as e:
+            tracing.warning('method_failed', method=method, hedged=True, error=str(e))
+            error = e
+            continue
+
+        # The loser cannot be cancelled mid-request; let it finish and drop its result file
+        for other in futures:
+            if other is not future:
+                other.add_done_callback(discard_result)
+        HEDGER.record_win(method)
+        return result_path
 
-        # Use the exact payload format from the example
-        boundary = "---011000010111000001101001"
+    if 'alt' not in futures.values():
+        # Method 1 failed before the hedge delay, so fall back exactly as without hedging
+        metrics.FALLBACKS.labels('sequential').inc()
+        result_path = run_method('alt', call_rapidapi_tryon_alt, cache_key, model_image, garment_image, progress)
+        HEDGER.record_win('alt')
+        return result_path
+    raise Exception(f"Failed to process API request (both methods): {str(error)}")
 
-        payload = f"-----011000010111000001101001\r\n"
-        payload += f"Content-Disposition: form-data; name=\"personImage\"\r\n\r\n"
-        payload += f"1.jpg\r\n"
-        payload += f"-----011000010111000001101001\r\n"
-        payload += f"Content-Disposition: form-data; name=\"clothImage\"\r\n\r\n"
-        payload += f"2.jpg\r\n"
-        payload += f"-----011000010111000001101001--\r\n\r\n"
+def run_in_thread(fn, *args):
+    """Start fn on a new daemon thread and return a Future for its result"""
+    future = Future()
 
-        headers = {
-            'x-rapidapi-key': RAPIDAPI_KEY,
-            'x-rapidapi-host': RAPIDAPI_HOST,
-            'Content-Type': f"multipart/form-data; boundary={boundary}"
-        }
+    def target():
+        future.set_running_or_notify_cancel()
+        try:
+            future.set_result(fn(*args))
+        except BaseException as e:
+            future.set_exception(e)
 
-        conn.request("POST", "/clothes-virtual-tryon", payload, headers)
+    threading.Thread(target=target, name='hedge-primary', daemon=True).start()
+    return future
 
-        res = conn.getresponse()
-        data = res.read()
+def discard_result(future):
+    """Remove the per-request result file of a losing hedged call; its cache entry is kept"""
+    try:
+        result_path = future.result()
+    except Exception:
+        return
+    if result_path and os.path.dirname(result_path) == app.config['RESULT_FOLDER'] and os.path.exists(result_path):
+        os.remove(result_path)
+
+def call_rapidapi_tryon_primary(cache_key, model_image, garment_image, progress=None):
+    """Method 1: multipart/form-data upload over the pooled upstream session; None means try Method 2"""
+    started = time.time()
+    report(progress, 'upstream_sent', method='primary')
+    with tracing.span('upstream_post', method='primary'):
+        response = UPSTREAM.post_tryon(model_image.data, garment_image.data)
+    report(progress, 'upstream_responded', method='primary', status=response.status_code,
+           latency_ms=(time.time() - started) * 1000)
+
+    if response.status_code in REJECTED_STATUSES:
+        # The input itself was refused; the alternative method would not fare better
+        reason = f"The try-on service rejected these images (status code {response.status_code})"
+        NEGATIVE_CACHE.add(cache_key, reason)
+        raise UpstreamRejected(reason)
+
+    if response.status_code != 200:
+        # If the first method fails, try the alternative method
+        tracing.warning('method_failed', method='primary', status=response.status_code)
+        return None
+
+    # Check if the response is JSON
+    content_type = response.headers.get('Content-Type', '')
+    if tracing.debug_enabled():
+        tracing.debug('upstream_response', method='primary', content_type=content_type, body=response.text[:200])
 
-        if res.status != 200:
-            raise Exception(f"API request failed with status code {res.status}: {data.decode('utf-8')}")
+    try:
+        # Try to parse as JSON
+        with tracing.span('json_parse', method='primary'):
+            json_response = response.json()
+        tracing.debug('upstream_json', method='primary', body=json_response)
+
+        # Check if the JSON contains a URL to the result image
+        if json_response.get('success') and 'response' in json_response and 'ouput_path_img' in json_response['response']:
+            # Get the image URL from the JSON response
+            image_url = json_response['response']['ouput_path_img']
+            tracing.debug('result_url', method='primary', url=image_url)
+
+            # Download the image from the URL into the cache
+            return download_result(cache_key, image_url, started, 'primary', progress)
+        else:
+            tracing.warning('unexpected_response', method='primary', reason='no image URL in JSON response')
+            return None
+    except ValueError:
+        # If not JSON, check if it's an image directly
+        if 'image' in content_type:
+            # Save the response content to the cache
+            result_path, _ = store_result(cache_key, (response.content,), started, 'primary')
+            report(progress, 'stored', method='primary', result_path=result_path)
+
+            return result_path
+        else:
+            tracing.warning('unexpected_response', method='primary', reason='neither JSON nor image')
+            return None
+
+def call_rapidapi_tryon_alt(cache_key, model_image, garment_image, progress=None):
+    """Alternative method to call the RapidAPI Virtual Try-On API with a hand-built multipart body"""
+    try:
+        started = time.time()
+        report(progress, 'upstream_sent', method='alt')
+        with tracing.span('upstream_post', method='alt'):
+            # Same images as Method 1, encoded in the layout of the RapidAPI example
+            res = UPSTREAM.post_tryon_raw(alt_payload(model_image.data, garment_image.data), ALT_CONTENT_TYPE)
+            data = res.content
+        report(progress, 'upstream_responded', method='alt', status=res.status_code,
+               latency_ms=(time.time() - started) * 1000)
+
+        if res.status_code != 200:
+            raise Exception(f"API request failed with status code {res.status_code}: {data.decode('utf-8', 'replace')}")
 
         # Try to parse the response as JSON
         try:
-            json_response = json.loads(data.decode('utf-8'))
-            print(f"JSON response from alt method: {json_response}")
+            with tracing.span('json_parse', method='alt'):
+                json_response = json.loads(data.decode('utf-8'))
+            tracing.debug('upstream_json', method='alt', body=json_response)
 
             # Check if the JSON contains a URL to the result image
             if json_response.get('success') and 'response' in json_response and 'ouput_path_img' in json_response['response']:
                 # Get the image URL from the JSON response
                 image_url = json_response['response']['ouput_path_img']
-                print(f"Image URL from API (alt method): {image_url}")
-
-                # Download the image from the URL
-                img_response = requests.get(image_url)
-                if img_response.status_code != 200:
-                    raise Exception(f"Failed to download image from URL: {img_response.status_code}")
-
-                # Save the result image
-                result_filename = f"result_{uuid.uuid4()}.jpg"
-                result_path = os.path.join(app.config['RESULT_FOLDER'], result_filename)
-
-                # Save the image content
-                with open(result_path, 'wb') as f:
-                    f.write(img_response.content)
-
-                # Generate a cache key for this request
-                cache_key = generate_cache_key(model_path, garment_path, "alt")
-
-                # Save to cache
-                save_to_cache(cache_key, img_response.content)
+                tracing.debug('result_url', method='alt', url=image_url)
 
+                # Download the image from the URL into the cache
+                result_path = download_result(cache_key, image_url, started, 'alt', progress)
+                if result_path is None:
+                    raise Exception("Failed to download image from URL")
                 return result_path
             else:
                 raise Exception("JSON response does not contain expected image URL")
-        except json.JSONDecodeError:
+        except (UnicodeDecodeError, json.JSONDecodeError):
             # If not JSON, assume it's the image directly
-            print("Response is not JSON, assuming it's the image directly")
-
-            # Save the result image
-            result_filename = f"result_{uuid.uuid4()}.jpg"
-            result_path = os.path.join(app.config['RESULT_FOLDER'], result_filename)
-
-            # Save the response content
-            with open(result_path, 'wb') as f:
-                f.write(data)
-
-            # Generate a cache key for this request
-            cache_key = generate_cache_key(model_path, garment_path, "alt")
+            tracing.debug('upstream_raw_image', method='alt')
 
-            # Save to cache
-            save_to_cache(cache_key, data)
+            # Save the response content to the cache
+            result_path, _ = store_result(cache_key, (data,), started, 'alt')
+            report(progress, 'stored', method='alt', result_path=result_path)
 
         return result_path
+    except CircuitOpen:
+        raise
     except Exception as e:
         raise Exception(f"Failed to process API request (both methods): {str(e)}")
 
@@ -0,0 +1,222 @@
+import io
+import json
+import math
+import sys
+import time
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from dotenv import load_dotenv
+from werkzeug.formparser import parse_form_data
+
+# Before metrics is imported, as in app.py: PROMETHEUS_MULTIPROC_DIR may come from .env
+load_dotenv()
+
+import metrics
+import tracing
+from app import app, CAPTURE, result_url, save_uploads, verify_result
+from async_pipeline import call_rapidapi_tryon_async, close_client
+from circuit_breaker import CircuitOpen, UpstreamRejected
+from rate_limit import RateLimitExceeded
+
+# The Flask routes run here rather than in asyncio's default executor, which the async pipeline's
+# cache and rate limit offloads need; a long event stream holds its thread for the whole stream
+WSGI_POOL = ThreadPoolExecutor(max_workers=app.config['ASGI_WSGI_THREADS'], thread_name_prefix='wsgi')
+
+
+async def application(scope, receive, send):
+    """ASGI entry point: `uvicorn asgi:application`; POST /api/try-on runs on the event loop"""
+    if scope['type'] == 'lifespan':
+        await lifespan(receive, send)
+    elif scope['type'] == 'http' and scope['path'] == '/api/try-on' and scope['method'] == 'POST':
+        await try_on(scope, receive, send)
+    else:
+        await flask_app(scope, receive, send)
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await close_client()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def read_body(receive, limit):
+    """The whole request body, or None once it grows past limit"""
+    body = bytearray()
+    more_body = True
+    while more_body:
+        message = await receive()
+        body += message.get('body', b'')
+        if len(body) > limit:
+            return None
+        more_body = message.get('more_body', False)
+    return bytes(body)
+
+
+def wsgi_environ(scope, body):
+    """A PEP 3333 environ for an ASGI HTTP request whose body has been read"""
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': (scope.get('server') or ('localhost', 80))[0],
+        'SERVER_PORT': str((scope.get('server') or ('localhost', 80))[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': (scope.get('client') or ('', 0))[0],
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope['headers']:
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name == 'CONTENT_TYPE':
+            environ['CONTENT_TYPE'] = value
+        elif name != 'CONTENT_LENGTH':
+            key = f"HTTP_{name}"
+            environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+def run_wsgi(environ, send, loop, disconnected):
+    """Run the Flask app on a worker thread, sending each body chunk as soon as the app yields it"""
+    response = {}
+
+    def send_message(message):
+        asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+    def start_response(status, headers, exc_info=None):
+        if exc_info is not None and response.get('started'):
+            raise exc_info[1].with_traceback(exc_info[2])
+        response['status'] = int(status.split(' ', 1)[0])
+        response['headers'] = [(name.encode('latin-1'), value.encode('latin-1')) for name, value in headers]
+
+    def start():
+        # Headers go out with the first chunk, so an error before it can still replace them
+        if not response.get('started'):
+            response['started'] = True
+            send_message({'type': 'http.response.start', 'status': response['status'],
+                          'headers': response['headers']})
+
+    iterable = app(environ, start_response)
+    try:
+        for chunk in iterable:
+            if disconnected.is_set():
+                # Stop an event stream the client has gone away from
+                return
+            if chunk:
+                start()
+                send_message({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+        start()
+        send_message({'type': 'http.response.body', 'body': b''})
+    finally:
+        if hasattr(iterable, 'close'):
+            iterable.close()
+
+
+async def watch_disconnect(receive, disconnected):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+    disconnected.set()
+
+
+async def flask_app(scope, receive, send):
+    """Serve every other route from the Flask app on WSGI_POOL, streaming its response"""
+    body = await read_body(receive, app.config['MAX_CONTENT_LENGTH'])
+    if body is None:
+        await respond(send, 413, {'error': 'Upload too large'})
+        return
+    disconnected = threading.Event()
+    watcher = asyncio.ensure_future(watch_disconnect(receive, disconnected))
+    loop = asyncio.get_running_loop()
+    try:
+        await loop.run_in_executor(WSGI_POOL, run_wsgi, wsgi_environ(scope, body), send, loop, disconnected)
+    finally:
+        watcher.cancel()
+
+
+async def respond(send, status, payload, headers=()):
+    body = json.dumps(payload).encode('utf-8')
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode())]
+                + [(name.encode(), value.encode()) for name, value in headers]})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+def parse_uploads(scope, body):
+    """Parse a multipart body with werkzeug and save the uploads like the Flask route does"""
+    headers = {name.decode('latin-1').lower(): value.decode('latin-1') for name, value in scope['headers']}
+    environ = {'REQUEST_METHOD': 'POST', 'wsgi.input': io.BytesIO(body), 'CONTENT_LENGTH': str(len(body)),
+               'CONTENT_TYPE': headers.get('content-type', '')}
+    _, form, files = parse_form_data(environ)
+    model_image, garment_image = save_uploads(files)
+    return model_image, garment_image, form.get('category', 'Upper body')
+
+
+async def try_on(scope, receive, send):
+    """JSON try-on: multipart model_image, garment_image and category in, {"result_url": ...} out"""
+    # prometheus_client's decorators would time the coroutine's creation, not the request
+    metrics.IN_FLIGHT.labels('async_try_on').inc()
+    started = time.time()
+    status = 500
+    capture = None
+    try:
+        body = await read_body(receive, app.config['MAX_CONTENT_LENGTH'])
+        if body is None:
+            status = 413
+            await respond(send, status, {'error': 'Upload too large'})
+            return
+
+        try:
+            model_image, garment_image, category = await asyncio.to_thread(parse_uploads, scope, body)
+        except ValueError as e:
+            status = 400
+            await respond(send, status, {'error': str(e)})
+            return
+        upload_ms = (time.time() - started) * 1000
+        if CAPTURE is not None:
+            capture = CAPTURE.start(model_image, garment_image, category, 'asgi', upload_ms)
+
+        try:
+            tracing.log('tryon_started', model_path=model_image.path, garment_path=garment_image.path,
+                        category=category, mode='asgi')
+            result_path = await call_rapidapi_tryon_async(
+                model_image, garment_image, category,
+                progress=CAPTURE.progress(capture) if capture is not None else None)
+            verify_result(result_path)
+        except RateLimitExceeded as e:
+            tracing.warning('rate_limited', retry_after=e.retry_after)
+            status = 429
+            await respond(send, status, {'error': str(e)}, [('Retry-After', str(math.ceil(e.retry_after)))])
+        except CircuitOpen as e:
+            tracing.warning('circuit_open', retry_after=e.retry_after)
+            status = 503
+            await respond(send, status, {'error': str(e)}, [('Retry-After', str(math.ceil(e.retry_after)))])
+        except UpstreamRejected as e:
+            status = 422
+            await respond(send, status, {'error': str(e)})
+        except Exception as e:
+            tracing.error('tryon_failed', exc_info=True, error=str(e))
+            status = 502
+            await respond(send, status, {'error': str(e)})
+        else:
+            tracing.log('tryon_succeeded', result_path=result_path, mode='asgi')
+            status = 200
+            await respond(send, status, {'result_url': result_url(result_path)})
+    finally:
+        metrics.IN_FLIGHT.labels('async_try_on').dec()
+        metrics.REQUEST_LATENCY.labels('async_try_on').observe(time.time() - started)
+        if capture is not None:
+            await asyncio.to_thread(CAPTURE.write, capture, status)
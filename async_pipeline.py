@@ -0,0 +1,276 @@
+import time
+import asyncio
+
+import metrics
+import tracing
+from app import (app, CIRCUIT, DOWNLOAD_CHUNK_SIZE, HEDGER, NEGATIVE_CACHE, RATE_LIMITER, REJECTED_STATUSES,
+                 RAPIDAPI_BASE_URL, RAPIDAPI_KEY, RAPIDAPI_HOST, SINGLE_FLIGHT, discard_result, generate_cache_key,
+                 index_perceptual_hashes, near_duplicate_lookup, reference_cached_result, report, store_result,
+                 verify_result)
+from circuit_breaker import CircuitOpen, UpstreamRejected
+from rate_limit import RateLimitExceeded
+from upstream import AsyncUpstreamClient, ALT_CONTENT_TYPE, alt_payload
+
+_client = None
+# End of an async iterator read by iterate_in_thread
+_END = object()
+
+
+def get_client():
+    """The process-wide async upstream client, created on first use inside the running event loop"""
+    global _client
+    if _client is None:
+        _client = AsyncUpstreamClient(RAPIDAPI_BASE_URL, RAPIDAPI_KEY, RAPIDAPI_HOST,
+                                      max_connections=app.config['ASYNC_MAX_CONNECTIONS'],
+                                      connect_timeout=app.config['UPSTREAM_CONNECT_TIMEOUT'],
+                                      read_timeout=app.config['UPSTREAM_READ_TIMEOUT'],
+                                      breaker=CIRCUIT)
+    return _client
+
+
+async def close_client():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+async def call_rapidapi_tryon_async(model_image, garment_image, category=None, progress=None):
+    """asyncio version of call_rapidapi_tryon: the event loop waits on the network, threads do the disk work"""
+    cache_key = generate_cache_key(model_image.digest, garment_image.digest, str(category))
+
+    cached_result = await asyncio.to_thread(reference_cached_result, cache_key, count=True)
+    if cached_result is not None:
+        tracing.log('cache_hit', cache_key=cache_key)
+        report(progress, 'cache_hit', cache_key=cache_key)
+        return cached_result
+
+    hashes, cached_result = await asyncio.to_thread(near_duplicate_lookup, str(category), model_image,
+                                                    garment_image, progress)
+    if cached_result is not None:
+        return cached_result
+    report(progress, 'cache_miss', cache_key=cache_key)
+
+    rejection = NEGATIVE_CACHE.get(cache_key)
+    if rejection is not None:
+        raise UpstreamRejected(rejection)
+
+    # Identical concurrent requests share one upstream call, in this process and across workers
+    result_path = await SINGLE_FLIGHT.do_async(
+        cache_key, lambda: fetch_tryon_result_async(cache_key, model_image, garment_image, progress))
+
+    await asyncio.to_thread(index_perceptual_hashes, cache_key, str(category), hashes)
+    return result_path
+
+
+async def acquire_rate_limit(max_wait):
+    """RATE_LIMITER.acquire without parking a thread while waiting for a token"""
+    deadline = time.time() + max_wait
+    while True:
+        acquired, retry_after = await asyncio.to_thread(RATE_LIMITER.try_acquire)
+        if acquired:
+            return
+        if time.time() + retry_after > deadline:
+            raise RateLimitExceeded(retry_after)
+        await asyncio.sleep(retry_after)
+
+
+async def fetch_tryon_result_async(cache_key, model_image, garment_image, progress=None):
+    """Call the upstream for a cache miss: Method 1, falling back to Method 2"""
+    cached_result = await asyncio.to_thread(reference_cached_result, cache_key)
+    if cached_result is not None:
+        tracing.log('cache_hit', cache_key=cache_key, concurrent=True)
+        report(progress, 'cache_hit', cache_key=cache_key, concurrent=True)
+        return cached_result
+
+    CIRCUIT.check()
+    await acquire_rate_limit(app.config['RATE_LIMIT_MAX_WAIT'])
+
+    if app.config['HEDGE_ENABLED']:
+        return await fetch_hedged_async(cache_key, model_image, garment_image, progress)
+
+    method = 'primary'
+    try:
+        result_path = await run_method_async('primary', call_primary_async, cache_key, model_image, garment_image,
+                                             progress)
+    except (CircuitOpen, UpstreamRejected):
+        raise
+    except Exception as e:
+        tracing.warning('method_failed', method='primary', error=str(e))
+        result_path = None
+
+    if result_path is None:
+        method = 'alt'
+        metrics.FALLBACKS.labels('sequential').inc()
+        result_path = await run_method_async('alt', call_alt_async, cache_key, model_image, garment_image, progress)
+    HEDGER.record_win(method)
+    return result_path
+
+
+async def run_method_async(method, fn, *args):
+    """run_method for a coroutine function"""
+    started = time.time()
+    result_path = await fn(*args)
+    if result_path is not None:
+        HEDGER.record(method, (time.time() - started) * 1000)
+    return result_path
+
+
+async def fetch_hedged_async(cache_key, model_image, garment_image, progress=None):
+    """fetch_hedged on the event loop: race Method 2 against a slow Method 1"""
+    tasks = {asyncio.ensure_future(run_method_async('primary', call_primary_async, cache_key, model_image,
+                                                    garment_image, progress)): 'primary'}
+
+    delay = HEDGER.delay('primary')
+    done, _ = await asyncio.wait(tasks, timeout=delay)
+    if not done:
+        # A hedge is a second upstream call, so it only goes out if the rate limit has a token to spare
+        acquired, _ = await asyncio.to_thread(RATE_LIMITER.try_acquire)
+        if acquired:
+            tracing.log('hedge_fired', delay_ms=delay * 1000)
+            HEDGER.record_hedge()
+            metrics.FALLBACKS.labels('hedged').inc()
+            report(progress, 'hedged', method='alt', delay_ms=delay * 1000)
+            tasks[asyncio.ensure_future(run_method_async('alt', call_alt_async, cache_key, model_image,
+                                                         garment_image, progress))] = 'alt'
+
+    error = None
+    pending = set(tasks)
+    while pending:
+        done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            method = tasks[task]
+            try:
+                result_path = task.result()
+                if result_path is None:
+                    continue
+                await asyncio.to_thread(verify_result, result_path)
+            except UpstreamRejected:
+                raise
+            except Exception as e:
+                tracing.warning('method_failed', method=method, hedged=True, error=str(e))
+                error = e
+                continue
+
+            # Let the loser finish and drop its result file, as in fetch_hedged
+            for other in tasks:
+                if other is not task:
+                    other.add_done_callback(discard_result)
+            HEDGER.record_win(method)
+            return result_path
+
+    if 'alt' not in tasks.values():
+        # Method 1 failed before the hedge delay, so fall back exactly as without hedging
+        metrics.FALLBACKS.labels('sequential').inc()
+        result_path = await run_method_async('alt', call_alt_async, cache_key, model_image, garment_image, progress)
+        HEDGER.record_win('alt')
+        return result_path
+    raise Exception(f"Failed to process API request (both methods): {str(error)}")
+
+
+async def call_primary_async(cache_key, model_image, garment_image, progress=None):
+    """Method 1 over the async client; None means try Method 2"""
+    client = get_client()
+    started = time.time()
+    report(progress, 'upstream_sent', method='primary')
+    response = await client.post_tryon(model_image.data, garment_image.data)
+    report(progress, 'upstream_responded', method='primary', status=response.status_code,
+           latency_ms=(time.time() - started) * 1000)
+
+    if response.status_code in REJECTED_STATUSES:
+        reason = f"The try-on service rejected these images (status code {response.status_code})"
+        NEGATIVE_CACHE.add(cache_key, reason)
+        raise UpstreamRejected(reason)
+    if response.status_code != 200:
+        tracing.warning('method_failed', method='primary', status=response.status_code)
+        return None
+
+    content_type = response.headers.get('Content-Type', '')
+    try:
+        json_response = response.json()
+    except ValueError:
+        if 'image' in content_type:
+            return await store_async(cache_key, response.content, started, 'primary', progress)
+        tracing.warning('unexpected_response', method='primary', reason='neither JSON nor image')
+        return None
+
+    image_url = result_image_url(json_response)
+    if image_url is None:
+        tracing.warning('unexpected_response', method='primary', reason='no image URL in JSON response')
+        return None
+
+    return await download_async(client, cache_key, image_url, started, 'primary', progress)
+
+
+async def call_alt_async(cache_key, model_image, garment_image, progress=None):
+    """Method 2 over the async client; raises if it fails too"""
+    client = get_client()
+    started = time.time()
+    report(progress, 'upstream_sent', method='alt')
+    response = await client.post_tryon_raw(alt_payload(model_image.data, garment_image.data), ALT_CONTENT_TYPE)
+    report(progress, 'upstream_responded', method='alt', status=response.status_code,
+           latency_ms=(time.time() - started) * 1000)
+    if response.status_code != 200:
+        raise Exception(f"Failed to process API request (both methods): status code {response.status_code}")
+
+    try:
+        json_response = response.json()
+    except ValueError:
+        # If not JSON, assume it's the image directly
+        return await store_async(cache_key, response.content, started, 'alt', progress)
+
+    image_url = result_image_url(json_response)
+    if image_url is None:
+        raise Exception("Failed to process API request (both methods): JSON response does not contain expected image URL")
+    result_path = await download_async(client, cache_key, image_url, started, 'alt', progress)
+    if result_path is None:
+        raise Exception("Failed to process API request (both methods): could not download the result image")
+    return result_path
+
+
+def result_image_url(json_response):
+    if isinstance(json_response, dict) and json_response.get('success') and \
+            'ouput_path_img' in (json_response.get('response') or {}):
+        return json_response['response']['ouput_path_img']
+    return None
+
+
+async def download_async(client, cache_key, image_url, started, method, progress=None):
+    """download_result over the async client: stream the result image into the cache; None if the download failed"""
+    download_started = time.time()
+    async with client.download_stream(image_url) as response:
+        if response.status_code != 200:
+            report(progress, 'downloaded', method=method, status=response.status_code,
+                   latency_ms=(time.time() - download_started) * 1000)
+            tracing.warning('download_failed', method=method, status=response.status_code)
+            return None
+        # Only one chunk per download is held in memory, however many calls are in flight
+        chunks = iterate_in_thread(response.aiter_bytes(DOWNLOAD_CHUNK_SIZE), asyncio.get_running_loop())
+        result_path, size = await asyncio.to_thread(store_result, cache_key, chunks, started, method)
+    metrics.DOWNLOAD_BYTES.labels(method).observe(size)
+    report(progress, 'downloaded', method=method, status=response.status_code, bytes=size,
+           latency_ms=(time.time() - download_started) * 1000)
+    report(progress, 'stored', method=method, result_path=result_path)
+    return result_path
+
+
+def iterate_in_thread(aiterator, loop):
+    """Iterate an async iterator from a worker thread, fetching each item on the event loop"""
+    async def next_item():
+        try:
+            return await aiterator.__anext__()
+        except StopAsyncIteration:
+            return _END
+
+    while True:
+        item = asyncio.run_coroutine_threadsafe(next_item(), loop).result()
+        if item is _END:
+            return
+        yield item
+
+
+async def store_async(cache_key, image_data, started, method, progress=None):
+    """Write the result once into the cache on a worker thread and link it in as this request's result"""
+    result_path, _ = await asyncio.to_thread(store_result, cache_key, (image_data,), started, method)
+    report(progress, 'stored', method=method, result_path=result_path)
+    return result_path
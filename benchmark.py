@@ -0,0 +1,192 @@
+import os
+import io
+import json
+import time
+import random
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from PIL import Image, ImageDraw
+from prometheus_client.parser import text_string_to_metric_families
+
+RESULTS_FOLDER = 'benchmark_results'
+COMPARED = [('throughput_rps', 'Throughput (req/s)'), ('latency_ms.p50', 'p50 latency (ms)'),
+            ('latency_ms.p95', 'p95 latency (ms)'), ('latency_ms.p99', 'p99 latency (ms)'),
+            ('success_ratio', 'Success ratio'), ('cache.disk.hit_ratio', 'Disk cache hit ratio'),
+            ('cache.memory.hit_ratio', 'Memory cache hit ratio'), ('upstream_calls', 'Upstream calls')]
+
+
+def make_image(seed, size=512):
+    """A deterministic JPEG per seed: same seed, same bytes, so the app's cache keys repeat across runs"""
+    rng = random.Random(seed)
+    img = Image.new('RGB', (size, size), tuple(rng.randrange(256) for _ in range(3)))
+    draw = ImageDraw.Draw(img)
+    for _ in range(12):
+        x, y = rng.randrange(size), rng.randrange(size)
+        draw.rectangle([x, y, x + rng.randrange(16, size // 2), y + rng.randrange(16, size // 2)],
+                       fill=tuple(rng.randrange(256) for _ in range(3)))
+    out = io.BytesIO()
+    img.save(out, 'JPEG', quality=90)
+    return out.getvalue()
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+
+def scrape(base_url):
+    """Current /metrics samples keyed by (name, labels), or {} if the app does not expose them"""
+    try:
+        text = requests.get(f"{base_url}/metrics", timeout=10).text
+        families = list(text_string_to_metric_families(text))
+    except Exception as e:
+        print(f"Could not scrape /metrics, cache ratios will be missing: {str(e)}")
+        return {}
+    return {(sample.name, tuple(sorted(sample.labels.items()))): sample.value
+            for family in families for sample in family.samples}
+
+
+def delta(before, after, name, **labels):
+    """Sum of the increase of every sample of `name` whose labels include `labels`"""
+    total = 0.0
+    for (sample_name, sample_labels), value in after.items():
+        if sample_name == name and all(dict(sample_labels).get(k) == v for k, v in labels.items()):
+            total += value - before.get((sample_name, sample_labels), 0.0)
+    return total
+
+
+def run(base_url, total, concurrency, models, garments, category, seed):
+    """Drive /try-on with `total` requests over `concurrency` connections and return the raw measurements"""
+    model_images = [make_image(f"model-{seed}-{i}") for i in range(models)]
+    garment_images = [make_image(f"garment-{seed}-{i}") for i in range(garments)]
+    rng = random.Random(seed)
+    pairs = [(rng.randrange(models), rng.randrange(garments)) for _ in range(total)]
+
+    local = threading.local()
+    latencies, statuses = [], {}
+    lock = threading.Lock()
+
+    def one(pair):
+        session = getattr(local, 'session', None)
+        if session is None:
+            session = local.session = requests.Session()
+        files = {'model_image': ('model.jpg', model_images[pair[0]], 'image/jpeg'),
+                 'garment_image': ('garment.jpg', garment_images[pair[1]], 'image/jpeg')}
+        started = time.perf_counter()
+        try:
+            status = str(session.post(f"{base_url}/try-on", files=files, data={'category': category},
+                                      allow_redirects=False, timeout=300).status_code)
+        except requests.RequestException as e:
+            status = type(e).__name__
+        latency_ms = (time.perf_counter() - started) * 1000
+        with lock:
+            latencies.append((status, latency_ms))
+            statuses[status] = statuses.get(status, 0) + 1
+
+    before = scrape(base_url)
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, pairs))
+    elapsed = time.perf_counter() - started
+    after = scrape(base_url)
+    return latencies, statuses, elapsed, before, after
+
+
+def summarize(latencies, statuses, elapsed, before, after):
+    all_ms = [ms for _, ms in latencies]
+    ok_ms = [ms for status, ms in latencies if status == '200']
+    summary = {
+        'requests': len(latencies),
+        'elapsed_seconds': round(elapsed, 3),
+        'throughput_rps': round(len(latencies) / elapsed, 3) if elapsed else None,
+        'success_ratio': round(len(ok_ms) / len(latencies), 4) if latencies else None,
+        'statuses': statuses,
+        'latency_ms': {f"p{p}": round(percentile(all_ms, p), 2) for p in (50, 95, 99)} if all_ms else {},
+        'ok_latency_ms': {f"p{p}": round(percentile(ok_ms, p), 2) for p in (50, 95, 99)} if ok_ms else {},
+    }
+    if after:
+        summary['cache'] = {}
+        for tier in ('memory', 'disk', 'near_duplicate'):
+            hits = delta(before, after, 'tryon_cache_lookups_total', tier=tier, result='hit')
+            misses = delta(before, after, 'tryon_cache_lookups_total', tier=tier, result='miss')
+            if hits or misses:
+                summary['cache'][tier] = {'hits': int(hits), 'misses': int(misses),
+                                          'hit_ratio': round(hits / (hits + misses), 4)}
+        summary['upstream_calls'] = int(delta(before, after, 'tryon_upstream_requests_total'))
+        summary['upstream_by_method'] = {method: int(delta(before, after, 'tryon_upstream_requests_total',
+                                                           method=method)) for method in ('primary', 'alt')}
+        summary['fallbacks'] = int(delta(before, after, 'tryon_fallbacks_total'))
+    return summary
+
+
+def save_result(label, config, summary, folder=RESULTS_FOLDER):
+    """Write a run to <folder>/<label>-<timestamp>.json for --compare; returns the path"""
+    result = {'label': label, 'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'), 'config': config, 'summary': summary}
+    os.makedirs(folder, exist_ok=True)
+    path = os.path.join(folder, f"{label}-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    with open(path, 'w') as f:
+        json.dump(result, f, indent=2)
+    return path
+
+
+def lookup(result, dotted):
+    value = result
+    for part in dotted.split('.'):
+        if not isinstance(value, dict) or part not in value:
+            return None
+        value = value[part]
+    return value
+
+
+def compare(paths):
+    """Print the headline numbers of saved runs side by side, with the change against the first"""
+    saved = []
+    for path in paths:
+        with open(path) as f:
+            saved.append(json.load(f))
+    print(f"{'':28}" + ''.join(f"{result['label'][:18]:>20}" for result in saved))
+    for key, title in COMPARED:
+        baseline = lookup(saved[0]['summary'], key)
+        cells = []
+        for result in saved:
+            value = lookup(result['summary'], key)
+            cell = '-' if value is None else f"{value:g}"
+            if value is not None and baseline and result is not saved[0]:
+                cell += f" ({(value - baseline) / baseline:+.0%})"
+            cells.append(f"{cell:>20}")
+        print(f"{title:28}" + ''.join(cells))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Benchmark /try-on at a fixed concurrency and save the results for comparison',
+        epilog='Run the app against fake_upstream.py (RAPIDAPI_BASE_URL) with RATE_LIMIT_SECONDS=0 for '
+               'repeatable numbers. Compare saved runs with --compare A.json B.json ...')
+    parser.add_argument('--url', default='http://127.0.0.1:5000', help='Base URL of the app under test')
+    parser.add_argument('--requests', type=int, default=200, help='Total /try-on requests to send')
+    parser.add_argument('--concurrency', type=int, default=8, help='Requests in flight at once')
+    parser.add_argument('--models', type=int, default=4, help='Distinct model images in the workload')
+    parser.add_argument('--garments', type=int, default=4,
+                        help='Distinct garment images; models x garments bounds the cache hit ratio')
+    parser.add_argument('--category', default='Upper body')
+    parser.add_argument('--seed', type=int, default=0, help='Seeds both the images and the request order')
+    parser.add_argument('--label', default='run', help='Name for this run in saved results and comparisons')
+    parser.add_argument('--output', default=RESULTS_FOLDER, help='Folder to save the JSON result in')
+    parser.add_argument('--compare', nargs='+', metavar='RESULT', help='Compare saved results instead of running')
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(args.compare)
+    else:
+        print(f"Sending {args.requests} requests to {args.url} with concurrency {args.concurrency} "
+              f"over {args.models * args.garments} distinct pairs")
+        summary = summarize(*run(args.url.rstrip('/'), args.requests, args.concurrency, args.models,
+                                 args.garments, args.category, args.seed))
+        config = {k: v for k, v in vars(args).items() if k not in ('compare', 'output')}
+        print(json.dumps(summary, indent=2))
+        print(f"Saved to {save_result(args.label, config, summary, args.output)}")
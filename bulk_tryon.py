@@ -0,0 +1,139 @@
+import os
+import json
+import time
+import shutil
+import argparse
+import itertools
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from app import (app, CACHE_INDEX, CACHE_ROUTE_PREFIX, allowed_file, call_rapidapi_tryon, generate_cache_key,
+                 load_from_cache, write_atomic)
+from prewarm import load_manifest, ImageDigests
+from rate_limit import RateLimitExceeded
+
+
+def list_images(folder):
+    return sorted(os.path.join(folder, name) for name in os.listdir(folder)
+                  if allowed_file(name) and not name.startswith('.'))
+
+
+def directory_pairs(models_dir, garments_dir, category):
+    """Every model x garment pair from two folders of images"""
+    return [(model, garment, category)
+            for model, garment in itertools.product(list_images(models_dir), list_images(garments_dir))]
+
+
+def stem(path):
+    return os.path.splitext(os.path.basename(path))[0]
+
+
+def output_path(output_dir, model_path, garment_path, category):
+    """<model>__<garment>.jpg, with the category appended unless it is the default"""
+    suffix = '' if category == 'Upper body' else f"__{category.lower().replace(' ', '-')}"
+    return os.path.join(output_dir, f"{stem(model_path)}__{stem(garment_path)}{suffix}.jpg")
+
+
+def export_result(result_path, out_path):
+    """Place a pipeline result at out_path without a second copy when possible, then drop the request link"""
+    if result_path.startswith(CACHE_ROUTE_PREFIX):
+        # Only the memory tier holds it
+        write_atomic(out_path, load_from_cache(result_path[len(CACHE_ROUTE_PREFIX):-len('.jpg')]))
+        return
+    try:
+        os.link(result_path, out_path)
+    except FileExistsError:
+        os.replace(result_path, out_path)
+    except OSError:
+        partial = out_path + '.part'
+        shutil.copyfile(result_path, partial)
+        os.replace(partial, out_path)
+    if os.path.dirname(result_path) == app.config['RESULT_FOLDER'] and os.path.exists(result_path):
+        os.remove(result_path)
+
+
+def run_pair(images, output_dir, model_path, garment_path, category):
+    """Produce one output image; returns (outcome, output path), outcome being 'skipped', 'cached' or 'generated'"""
+    out_path = output_path(output_dir, model_path, garment_path, category)
+    if os.path.exists(out_path):
+        return 'skipped', out_path
+
+    model_image = images.get(model_path)
+    garment_image = images.get(garment_path)
+    cache_key = generate_cache_key(model_image.digest, garment_image.digest, str(category))
+    was_cached = CACHE_INDEX.lookup(cache_key) is not None
+
+    result_path = call_rapidapi_tryon(model_path, garment_path, category,
+                                      model_image=model_image, garment_image=garment_image)
+    export_result(result_path, out_path)
+    return ('cached' if was_cached else 'generated'), out_path
+
+
+def bulk_tryon(pairs, output_dir, concurrency=2):
+    """Run every pair, writing results to output_dir as they finish and logging each outcome to results.jsonl"""
+    os.makedirs(output_dir, exist_ok=True)
+    images = ImageDigests()
+    counts = {'skipped': 0, 'cached': 0, 'generated': 0, 'failed': 0, 'rate_limited': 0}
+    log_lock = threading.Lock()
+    started = time.time()
+
+    with open(os.path.join(output_dir, 'results.jsonl'), 'a') as log, \
+            ThreadPoolExecutor(max_workers=concurrency) as pool:
+        futures = {pool.submit(run_pair, images, output_dir, *pair): pair for pair in pairs}
+        for done, future in enumerate(as_completed(futures), 1):
+            model_path, garment_path, category = futures[future]
+            entry = {'model': model_path, 'garment': garment_path, 'category': category, 'ts': time.time()}
+            try:
+                outcome, entry['output'] = future.result()
+            except RateLimitExceeded as e:
+                outcome, entry['error'] = 'rate_limited', str(e)
+            except Exception as e:
+                outcome, entry['error'] = 'failed', str(e)
+            counts[outcome] += 1
+            entry['outcome'] = outcome
+            if outcome != 'skipped':
+                with log_lock:
+                    log.write(json.dumps(entry) + '\n')
+                    log.flush()
+
+            elapsed = time.time() - started
+            print(f"[{done}/{len(pairs)}] {outcome}: {os.path.basename(model_path)} x "
+                  f"{os.path.basename(garment_path)} ({category}) {done / elapsed:.2f} pairs/s"
+                  + (f" - {entry['error']}" if 'error' in entry else ''))
+
+    elapsed = time.time() - started
+    produced = counts['cached'] + counts['generated']
+    counts['elapsed_seconds'] = round(elapsed, 1)
+    counts['pairs_per_second'] = round(len(pairs) / elapsed, 3) if elapsed else None
+    counts['produced_per_second'] = round(produced / elapsed, 3) if elapsed else None
+    return counts
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Run many model x garment try-ons through the app\'s cache and upstream client',
+        epilog='Pairs whose output image already exists are skipped, so an interrupted run resumes where it '
+               'stopped; failed pairs are retried. Each outcome is appended to OUTPUT/results.jsonl.')
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--manifest', help='CSV, JSONL or JSON manifest of pairs (see prewarm.py)')
+    source.add_argument('--models', help='Folder of model images, paired with every image in --garments')
+    parser.add_argument('--garments', help='Folder of garment images (with --models)')
+    parser.add_argument('--output', required=True, help='Folder to write result images to')
+    parser.add_argument('--concurrency', type=int, default=2, help='Maximum parallel upstream calls')
+    parser.add_argument('--max-wait', type=float, default=3600,
+                        help='Seconds a pair may wait for the shared rate limiter before it is skipped')
+    parser.add_argument('--category', default='Upper body', help='Category for pairs that do not set one')
+    args = parser.parse_args()
+    if args.models and not args.garments:
+        parser.error('--models needs --garments')
+
+    # Queue on the shared rate limiter instead of failing fast like interactive requests
+    app.config['RATE_LIMIT_MAX_WAIT'] = args.max_wait
+
+    if args.manifest:
+        pairs = load_manifest(args.manifest, args.category)
+    else:
+        pairs = directory_pairs(args.models, args.garments, args.category)
+    print(f"Running {len(pairs)} pairs with concurrency {args.concurrency} into {args.output}")
+    summary = bulk_tryon(pairs, args.output, args.concurrency)
+    print(json.dumps(summary, indent=2))
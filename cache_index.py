@@ -0,0 +1,185 @@
+import os
+import time
+import sqlite3
+import threading
+from collections import namedtuple
+
+import tracing
+
+# One indexed cache entry
+IndexEntry = namedtuple('IndexEntry', ['cache_key', 'path', 'size', 'created', 'last_access',
+                                       'hits', 'latency_ms', 'method'])
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    cache_key TEXT PRIMARY KEY,
+    path TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    created REAL NOT NULL,
+    last_access REAL NOT NULL,
+    hits INTEGER NOT NULL DEFAULT 0,
+    latency_ms REAL,
+    method TEXT
+);
+CREATE INDEX IF NOT EXISTS entries_last_access ON entries (last_access);
+CREATE INDEX IF NOT EXISTS entries_hits ON entries (hits, last_access);
+
+-- Running totals so stats and quota checks never scan the table
+CREATE TABLE IF NOT EXISTS totals (
+    id INTEGER PRIMARY KEY CHECK (id = 0),
+    entries INTEGER NOT NULL,
+    bytes INTEGER NOT NULL,
+    hits INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO totals VALUES (0, 0, 0, 0);
+
+CREATE TRIGGER IF NOT EXISTS entries_insert AFTER INSERT ON entries BEGIN
+    UPDATE totals SET entries = entries + 1, bytes = bytes + NEW.size, hits = hits + NEW.hits;
+END;
+CREATE TRIGGER IF NOT EXISTS entries_delete AFTER DELETE ON entries BEGIN
+    UPDATE totals SET entries = entries - 1, bytes = bytes - OLD.size, hits = hits - OLD.hits;
+END;
+CREATE TRIGGER IF NOT EXISTS entries_update AFTER UPDATE ON entries BEGIN
+    UPDATE totals SET bytes = bytes - OLD.size + NEW.size, hits = hits - OLD.hits + NEW.hits;
+END;
+"""
+
+# Eviction orderings: least recently used, or least frequently used with recency as the tie-break
+EVICTION_ORDER = {
+    'lru': 'last_access',
+    'lfu': 'hits, last_access',
+}
+
+
+class CacheIndex:
+    """SQLite index of the result cache: what is cached, how big, how hot and where it came from"""
+
+    def __init__(self, db_path, cache_folder):
+        self.db_path = db_path
+        self.cache_folder = cache_folder
+        self._local = threading.local()
+        self._rebuild_lock = threading.Lock()
+
+        needs_rebuild = not os.path.exists(db_path)
+        try:
+            self._connect().executescript(SCHEMA)
+        except sqlite3.DatabaseError as e:
+            tracing.warning('cache_index_unreadable', path=db_path, error=str(e))
+            self._discard_database()
+            self._connect().executescript(SCHEMA)
+            needs_rebuild = True
+        if needs_rebuild:
+            self.rebuild()
+        else:
+            self.recount()
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=5.0, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def _discard_database(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+        for suffix in ('', '-wal', '-shm'):
+            try:
+                os.remove(self.db_path + suffix)
+            except FileNotFoundError:
+                pass
+
+    def rebuild(self):
+        """Repopulate the index from the files in the cache folder"""
+        with self._rebuild_lock:
+            conn = self._connect()
+            rows = []
+            for root, dirs, files in os.walk(self.cache_folder):
+                dirs[:] = [d for d in dirs if not d.startswith('.')]
+                for name in files:
+                    if name.startswith('.') or not name.endswith('.jpg'):
+                        continue
+                    path = os.path.join(root, name)
+                    try:
+                        st = os.stat(path)
+                    except FileNotFoundError:
+                        continue
+                    rows.append((name[:-4], path, st.st_size, st.st_mtime, max(st.st_atime, st.st_mtime)))
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                conn.execute('DELETE FROM entries')
+                conn.executemany(
+                    'INSERT OR IGNORE INTO entries (cache_key, path, size, created, last_access, hits, method) '
+                    "VALUES (?, ?, ?, ?, ?, 0, 'unknown')", rows)
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+            tracing.log('cache_index_rebuilt', entries=len(rows))
+            return len(rows)
+
+    def recount(self):
+        """Recompute the running totals from the entries table"""
+        # Indexes written before add() became an upsert over-count every re-added key
+        self._connect().execute(
+            'UPDATE totals SET (entries, bytes, hits) = '
+            '(SELECT COUNT(*), COALESCE(SUM(size), 0), COALESCE(SUM(hits), 0) FROM entries) WHERE id = 0')
+
+    def lookup(self, cache_key):
+        """Return the entry for a key, or None"""
+        row = self._connect().execute(
+            'SELECT cache_key, path, size, created, last_access, hits, latency_ms, method '
+            'FROM entries WHERE cache_key = ?', (cache_key,)).fetchone()
+        return IndexEntry(*row) if row else None
+
+    def record_hit(self, cache_key, size=None):
+        """Count a hit and refresh the entry's last access time; False if there is no such entry (of that size)"""
+        if size is None:
+            cursor = self._connect().execute(
+                'UPDATE entries SET hits = hits + 1, last_access = ? WHERE cache_key = ?', (time.time(), cache_key))
+        else:
+            cursor = self._connect().execute(
+                'UPDATE entries SET hits = hits + 1, last_access = ? WHERE cache_key = ? AND size = ?',
+                (time.time(), cache_key, size))
+        return cursor.rowcount > 0
+
+    def add(self, cache_key, path, size, latency_ms=None, method=None, replace=True):
+        """Record a newly written cache entry; with replace=False an existing entry for the key is kept"""
+        now = time.time()
+        # An upsert, not INSERT OR REPLACE: REPLACE's implicit delete skips entries_delete and inflates totals
+        on_conflict = ('DO UPDATE SET path = excluded.path, size = excluded.size, created = excluded.created, '
+                       'last_access = excluded.last_access, hits = 0, latency_ms = excluded.latency_ms, '
+                       'method = excluded.method') if replace else 'DO NOTHING'
+        self._connect().execute(
+            'INSERT INTO entries (cache_key, path, size, created, last_access, hits, latency_ms, method) '
+            f'VALUES (?, ?, ?, ?, ?, 0, ?, ?) ON CONFLICT (cache_key) {on_conflict}',
+            (cache_key, path, size, now, now, latency_ms, method))
+
+    def remove(self, cache_key):
+        """Forget an entry"""
+        self._connect().execute('DELETE FROM entries WHERE cache_key = ?', (cache_key,))
+
+    def expired(self, ttl_seconds, now=None):
+        """Return entries not accessed within ttl_seconds"""
+        now = time.time() if now is None else now
+        rows = self._connect().execute(
+            'SELECT cache_key, path, size, created, last_access, hits, latency_ms, method '
+            'FROM entries WHERE last_access < ? ORDER BY last_access', (now - ttl_seconds,)).fetchall()
+        return [IndexEntry(*row) for row in rows]
+
+    def eviction_candidates(self, limit, policy='lru'):
+        """Return up to `limit` entries in eviction order"""
+        rows = self._connect().execute(
+            'SELECT cache_key, path, size, created, last_access, hits, latency_ms, method '
+            f'FROM entries ORDER BY {EVICTION_ORDER[policy]} LIMIT ?', (limit,)).fetchall()
+        return [IndexEntry(*row) for row in rows]
+
+    def stats(self):
+        """Return entry count, total bytes and total hits"""
+        entries, size, hits = self._connect().execute(
+            'SELECT entries, bytes, hits FROM totals WHERE id = 0').fetchone()
+        return {'entries': entries, 'bytes': size, 'hits': hits}
@@ -0,0 +1,53 @@
+import os
+import json
+import time
+
+
+class TrafficCapture:
+    """Appends one JSON line per try-on request for replay.py; O_APPEND keeps lines from all workers whole"""
+
+    def __init__(self, path):
+        self.path = path
+
+    def start(self, model_image, garment_image, category, mode, upload_ms=None):
+        """Begin a record for a request whose uploads have been saved and hashed"""
+        return {
+            'ts': time.time(),
+            'mode': mode,
+            'category': category,
+            'model_digest': model_image.digest,
+            'model_bytes': len(model_image.data),
+            'garment_digest': garment_image.digest,
+            'garment_bytes': len(garment_image.data),
+            'cache': None,
+            'method': None,
+            'timings': {'upload_ms': round(upload_ms, 2) if upload_ms is not None else None},
+        }
+
+    def progress(self, record, inner=None):
+        """Progress callback that fills in the cache outcome, method and upstream timings, then calls inner"""
+        def callback(stage, **data):
+            if stage == 'cache_hit':
+                record['cache'] = ('near_duplicate' if data.get('near_duplicate') else
+                                   'concurrent' if data.get('concurrent') else 'hit')
+            elif stage == 'cache_miss':
+                record['cache'] = 'miss'
+            elif stage == 'stored' and record['method'] is None:
+                # With hedging the losing method may store later; the first one is what was served
+                record['method'] = data.get('method')
+            elif stage in ('upstream_responded', 'downloaded') and data.get('latency_ms') is not None:
+                key = f"{data.get('method')}_{'upstream' if stage == 'upstream_responded' else 'download'}_ms"
+                record['timings'][key] = round(data['latency_ms'], 2)
+            if inner is not None:
+                inner(stage, **data)
+        return callback
+
+    def write(self, record, status):
+        record['status'] = status
+        record['timings']['total_ms'] = round((time.time() - record['ts']) * 1000, 2)
+        line = (json.dumps(record) + '\n').encode('utf-8')
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, line)
+        finally:
+            os.close(fd)
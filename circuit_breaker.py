@@ -0,0 +1,117 @@
+import time
+import threading
+from collections import OrderedDict
+
+import tracing
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitOpen(Exception):
+    """Raised instead of calling an upstream that is known to be failing"""
+
+    def __init__(self, retry_after):
+        self.retry_after = retry_after
+        super().__init__(f"Try-on service is temporarily unavailable, retry in {int(retry_after) + 1} seconds")
+
+
+class UpstreamRejected(Exception):
+    """Raised when the upstream has definitively rejected a model/garment pair"""
+
+
+class CircuitBreaker:
+    """Closed/open/half-open breaker: opens after consecutive failures, then lets one trial call through"""
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.times_opened = 0
+        self.rejected = 0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def _refresh(self, now):
+        if self.state == OPEN and now - self.opened_at >= self.reset_timeout:
+            self.state = HALF_OPEN
+            self._trial_in_flight = False
+
+    def _raise_if_blocked(self, now):
+        if self.state == OPEN:
+            self.rejected += 1
+            raise CircuitOpen(self.reset_timeout - (now - self.opened_at))
+        if self.state == HALF_OPEN and self._trial_in_flight:
+            self.rejected += 1
+            raise CircuitOpen(self.reset_timeout)
+
+    def check(self):
+        """Raise CircuitOpen if a call would be refused, without claiming the half-open trial"""
+        with self._lock:
+            now = time.time()
+            self._refresh(now)
+            self._raise_if_blocked(now)
+
+    def before_call(self):
+        """Raise CircuitOpen, or admit a call (claiming the single trial when half-open)"""
+        with self._lock:
+            now = time.time()
+            self._refresh(now)
+            self._raise_if_blocked(now)
+            if self.state == HALF_OPEN:
+                self._trial_in_flight = True
+
+    def record_success(self):
+        with self._lock:
+            self.state = CLOSED
+            self.failures = 0
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != OPEN:
+                    self.times_opened += 1
+                    tracing.warning('circuit_opened', consecutive_failures=self.failures)
+                self.state = OPEN
+                self.opened_at = time.time()
+                self._trial_in_flight = False
+
+    def stats(self):
+        with self._lock:
+            self._refresh(time.time())
+            return {'state': self.state, 'consecutive_failures': self.failures,
+                    'times_opened': self.times_opened, 'rejected': self.rejected}
+
+
+class NegativeCache:
+    """Short-lived memory of inputs the upstream rejected, so they are not re-sent"""
+
+    def __init__(self, ttl_seconds=300, max_entries=10000):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, cache_key, reason):
+        with self._lock:
+            self._entries.pop(cache_key, None)
+            self._entries[cache_key] = (time.time() + self.ttl_seconds, reason)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get(self, cache_key):
+        """Return the rejection reason for a key, or None if unknown or expired"""
+        with self._lock:
+            entry = self._entries.get(cache_key)
+            if entry is None:
+                return None
+            expires, reason = entry
+            if time.time() >= expires:
+                del self._entries[cache_key]
+                return None
+            return reason
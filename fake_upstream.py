@@ -0,0 +1,101 @@
+import io
+import math
+import time
+import uuid
+import random
+import argparse
+import threading
+from flask import Flask, jsonify, request, Response
+from PIL import Image
+
+fake = Flask(__name__)
+settings = argparse.Namespace()
+counts = {'tryon': 0, 'download': 0, 'errors': 0, 'rejected': 0}
+counts_lock = threading.Lock()
+result_image = b''
+
+
+def count(name):
+    with counts_lock:
+        counts[name] += 1
+
+
+def sample_latency(distribution, latency_ms, jitter_ms):
+    """Seconds to stall a response: fixed, uniform (+/- jitter), normal (sd jitter) or lognormal (median latency)"""
+    if distribution == 'uniform':
+        ms = random.uniform(latency_ms - jitter_ms, latency_ms + jitter_ms)
+    elif distribution == 'normal':
+        ms = random.gauss(latency_ms, jitter_ms)
+    elif distribution == 'lognormal':
+        sigma = jitter_ms / latency_ms if latency_ms > 0 else 0
+        ms = latency_ms * math.exp(random.gauss(0, sigma))
+    else:
+        ms = latency_ms
+    return max(ms, 0) / 1000
+
+
+def make_result_image(size, quality=85):
+    """A noisy JPEG, so the result does not compress down to nothing"""
+    img = Image.effect_noise((size, size), 64).convert('RGB')
+    out = io.BytesIO()
+    img.save(out, 'JPEG', quality=quality)
+    return out.getvalue()
+
+
+@fake.route('/clothes-virtual-tryon', methods=['POST'])
+def tryon():
+    count('tryon')
+    time.sleep(sample_latency(settings.latency, settings.latency_ms, settings.jitter_ms))
+
+    roll = random.random()
+    if roll < settings.error_rate:
+        count('errors')
+        return jsonify(success=False, message='Simulated upstream error'), 500
+    if roll < settings.error_rate + settings.reject_rate:
+        count('rejected')
+        return jsonify(success=False, message='Simulated rejection: no person detected'), 400
+
+    if settings.mode == 'image':
+        return Response(result_image, mimetype='image/jpeg')
+    return jsonify(success=True, response={
+        'ouput_path_img': f"{request.host_url.rstrip('/')}/results/{uuid.uuid4().hex}.jpg"})
+
+
+@fake.route('/results/<name>.jpg')
+def download(name):
+    count('download')
+    time.sleep(sample_latency(settings.latency, settings.download_latency_ms, 0))
+    return Response(result_image, mimetype='image/jpeg')
+
+
+@fake.route('/stats')
+def stats():
+    with counts_lock:
+        return jsonify(counts)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Local stand-in for the RapidAPI try-on host, for load tests and benchmarks',
+        epilog='Point the app at it with RAPIDAPI_BASE_URL=http://HOST:PORT, and RATE_LIMIT_SECONDS=0 '
+               'so the rate limiter does not throttle the run.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=9000)
+    parser.add_argument('--mode', choices=['json', 'image'], default='json',
+                        help='Answer with JSON holding ouput_path_img, or with the image itself')
+    parser.add_argument('--latency', choices=['fixed', 'uniform', 'normal', 'lognormal'], default='fixed',
+                        help='Distribution of the try-on call latency')
+    parser.add_argument('--latency-ms', type=float, default=500, help='Fixed/mean/median latency')
+    parser.add_argument('--jitter-ms', type=float, default=0, help='Spread of the latency distribution')
+    parser.add_argument('--download-latency-ms', type=float, default=20, help='Latency of result image downloads')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of calls answered with a 500')
+    parser.add_argument('--reject-rate', type=float, default=0.0, help='Fraction of calls answered with a 400')
+    parser.add_argument('--image-size', type=int, default=768, help='Side of the square result image')
+    parser.add_argument('--seed', type=int, default=None)
+    settings = parser.parse_args()
+
+    random.seed(settings.seed)
+    result_image = make_result_image(settings.image_size)
+    print(f"Fake upstream on http://{settings.host}:{settings.port} ({settings.mode}, "
+          f"{settings.latency} {settings.latency_ms}ms, result {len(result_image)} bytes)")
+    fake.run(host=settings.host, port=settings.port, threaded=True)
@@ -0,0 +1,23 @@
+import os
+import shutil
+
+# Workers share metrics through this directory; it must be set before app.py is imported
+os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', 'metrics_multiproc')
+
+# Threaded workers: a /jobs/<id>/events stream holds one thread for the job's lifetime instead of a whole
+# worker, and the arbiter's timeout only watches the worker's main loop, so long streams are not killed
+worker_class = 'gthread'
+threads = int(os.getenv('GUNICORN_THREADS', 32))
+
+
+def on_starting(server):
+    """Start from an empty metrics directory so samples from a previous run are not merged in"""
+    path = os.environ['PROMETHEUS_MULTIPROC_DIR']
+    shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(path, exist_ok=True)
+
+
+def child_exit(server, worker):
+    """Drop the live gauges of a worker that exited; its counters keep counting toward the totals"""
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,60 @@
+import math
+import threading
+from collections import deque
+
+
+class Hedger:
+    """Per-method upstream latencies and win counts, and the delay before a hedged call is fired"""
+
+    def __init__(self, percentile=95, default_delay=10.0, min_samples=20, window=200):
+        self.percentile = percentile
+        self.default_delay = default_delay
+        self.min_samples = min_samples
+        self.window = window
+        self._latencies = {}
+        self._wins = {}
+        self.hedges_fired = 0
+        self._lock = threading.Lock()
+
+    def record(self, method, latency_ms):
+        """Record a successful call's end-to-end latency, whether or not its result was served"""
+        with self._lock:
+            self._latencies.setdefault(method, deque(maxlen=self.window)).append(latency_ms)
+
+    def record_win(self, method):
+        """Count the method whose result was served"""
+        with self._lock:
+            self._wins[method] = self._wins.get(method, 0) + 1
+
+    def record_hedge(self):
+        with self._lock:
+            self.hedges_fired += 1
+
+    def _percentile(self, samples, percentile):
+        ordered = sorted(samples)
+        return ordered[max(0, math.ceil(percentile / 100 * len(ordered)) - 1)]
+
+    def delay(self, method='primary'):
+        """Seconds to wait on `method` before hedging: its recent p95, or the default until warmed up"""
+        with self._lock:
+            samples = list(self._latencies.get(method, ()))
+        if len(samples) < self.min_samples:
+            return self.default_delay
+        return self._percentile(samples, self.percentile) / 1000
+
+    def stats(self):
+        with self._lock:
+            latencies = {method: list(samples) for method, samples in self._latencies.items()}
+            wins = dict(self._wins)
+            hedges_fired = self.hedges_fired
+        total_wins = sum(wins.values())
+        methods = {}
+        for method, samples in latencies.items():
+            methods[method] = {
+                'samples': len(samples),
+                'p50_ms': round(self._percentile(samples, 50), 1),
+                'p95_ms': round(self._percentile(samples, 95), 1),
+                'wins': wins.get(method, 0),
+                'win_rate': round(wins.get(method, 0) / total_wins, 3) if total_wins else None,
+            }
+        return {'hedges_fired': hedges_fired, 'hedge_delay_seconds': round(self.delay(), 3), 'methods': methods}
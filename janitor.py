@@ -0,0 +1,199 @@
+import os
+import time
+import argparse
+import threading
+from collections import namedtuple
+
+import tracing
+
+# Limits for one folder; None disables that limit
+FolderQuota = namedtuple('FolderQuota', ['max_bytes', 'max_files', 'ttl_seconds'])
+
+# A file seen during a sweep; `used` is the timestamp eviction is ordered by
+FileEntry = namedtuple('FileEntry', ['path', 'size', 'used'])
+
+
+def _env_int(name, default):
+    value = os.getenv(name)
+    return int(value) if value not in (None, '') else default
+
+
+def quotas_from_config(config):
+    """Build the per-folder quotas from the app config"""
+    return {
+        config['CACHE_FOLDER']: (config['CACHE_QUOTA'], config.get('CACHE_EVICTION_POLICY', 'lru')),
+        config['RESULT_FOLDER']: (config['RESULT_QUOTA'], 'expire'),
+        config['UPLOAD_FOLDER']: (config['UPLOAD_QUOTA'], 'expire'),
+    }
+
+
+def default_quota(prefix, max_bytes, max_files, ttl_seconds):
+    """Read a folder quota from <PREFIX>_MAX_BYTES/_MAX_FILES/_TTL_SECONDS, using 0 to disable a limit"""
+    values = [
+        _env_int(f'{prefix}_MAX_BYTES', max_bytes),
+        _env_int(f'{prefix}_MAX_FILES', max_files),
+        _env_int(f'{prefix}_TTL_SECONDS', ttl_seconds),
+    ]
+    return FolderQuota(*[value or None for value in values])
+
+
+def scan_folder(folder, policy):
+    """List the files under a folder, skipping hidden entries such as lock files"""
+    entries = []
+    stack = [folder]
+    while stack:
+        try:
+            iterator = os.scandir(stack.pop())
+        except FileNotFoundError:
+            continue
+        with iterator:
+            for entry in iterator:
+                if entry.name.startswith('.'):
+                    continue
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                        continue
+                    st = entry.stat(follow_symlinks=False)
+                except FileNotFoundError:
+                    continue
+                if policy in ('lru', 'lfu'):
+                    # Without an index, the cache's LRU/LFU order falls back to last access time
+                    used = max(st.st_atime, st.st_mtime)
+                else:
+                    # A hardlinked result shares its cache entry's mtime; ctime moves when the link is made
+                    used = max(st.st_ctime, st.st_mtime)
+                # Bytes shared with another link (a result and its cache entry) are freed with the last link
+                size = st.st_size if st.st_nlink <= 1 else 0
+                entries.append(FileEntry(entry.path, size, used))
+    return entries
+
+
+def select_victims(entries, quota, now):
+    """Pick the files to delete: everything past its TTL, then the oldest until under quota"""
+    entries = sorted(entries, key=lambda e: e.used)
+    victims = []
+    kept = []
+    for entry in entries:
+        if quota.ttl_seconds is not None and now - entry.used > quota.ttl_seconds:
+            victims.append(entry)
+        else:
+            kept.append(entry)
+
+    total_bytes = sum(e.size for e in kept)
+    total_files = len(kept)
+    for entry in kept:
+        over_bytes = quota.max_bytes is not None and total_bytes > quota.max_bytes
+        over_files = quota.max_files is not None and total_files > quota.max_files
+        if not (over_bytes or over_files):
+            break
+        if not over_files and entry.size == 0:
+            # Removing a shared link frees nothing
+            continue
+        victims.append(entry)
+        total_bytes -= entry.size
+        total_files -= 1
+    return victims
+
+
+def sweep_folder(folder, quota, policy='expire', dry_run=False, now=None):
+    """Enforce a quota on one folder and return (files_removed, bytes_reclaimed)"""
+    now = time.time() if now is None else now
+    victims = select_victims(scan_folder(folder, policy), quota, now)
+
+    files_removed = 0
+    bytes_reclaimed = 0
+    for entry in victims:
+        if not dry_run:
+            try:
+                os.remove(entry.path)
+            except FileNotFoundError:
+                # Another worker's janitor got there first
+                continue
+        files_removed += 1
+        bytes_reclaimed += entry.size
+    return files_removed, bytes_reclaimed
+
+
+def sweep_index(index, quota, policy='lru', dry_run=False, now=None, batch_size=500):
+    """Enforce a quota on the indexed cache using index queries instead of a folder scan"""
+    victims = list(index.expired(quota.ttl_seconds, now)) if quota.ttl_seconds is not None else []
+    seen = {entry.cache_key for entry in victims}
+
+    stats = index.stats()
+    total_bytes = stats['bytes'] - sum(e.size for e in victims)
+    total_files = stats['entries'] - len(victims)
+
+    def over_quota():
+        return ((quota.max_bytes is not None and total_bytes > quota.max_bytes) or
+                (quota.max_files is not None and total_files > quota.max_files))
+
+    limit = batch_size
+    while over_quota():
+        candidates = [e for e in index.eviction_candidates(limit, policy) if e.cache_key not in seen]
+        if not candidates:
+            break
+        for entry in candidates:
+            if not over_quota():
+                break
+            victims.append(entry)
+            seen.add(entry.cache_key)
+            total_bytes -= entry.size
+            total_files -= 1
+        limit += batch_size
+
+    files_removed = 0
+    bytes_reclaimed = 0
+    for entry in victims:
+        if not dry_run:
+            try:
+                os.remove(entry.path)
+            except FileNotFoundError:
+                pass
+            index.remove(entry.cache_key)
+        files_removed += 1
+        bytes_reclaimed += entry.size
+    return files_removed, bytes_reclaimed
+
+
+def run_janitor(config, dry_run=False, index=None):
+    """Sweep every managed folder and report what was reclaimed"""
+    report = {}
+    for folder, (quota, policy) in quotas_from_config(config).items():
+        if index is not None and folder == config['CACHE_FOLDER']:
+            files_removed, bytes_reclaimed = sweep_index(index, quota, policy, dry_run=dry_run)
+        else:
+            files_removed, bytes_reclaimed = sweep_folder(folder, quota, policy, dry_run=dry_run)
+        report[folder] = {'files_removed': files_removed, 'bytes_reclaimed': bytes_reclaimed}
+        if files_removed:
+            tracing.log('janitor_swept', folder=folder, files_removed=files_removed, bytes_reclaimed=bytes_reclaimed,
+                        dry_run=dry_run)
+    return report
+
+
+def start_janitor(config, interval_seconds, index=None):
+    """Run the janitor every interval_seconds on a daemon thread"""
+    def loop():
+        while True:
+            time.sleep(interval_seconds)
+            try:
+                run_janitor(config, index=index)
+            except Exception as e:
+                tracing.error('janitor_failed', exc_info=True, error=str(e))
+
+    thread = threading.Thread(target=loop, name='janitor', daemon=True)
+    thread.start()
+    return thread
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Evict expired and over-quota files from the static folders')
+    parser.add_argument('--dry-run', action='store_true', help='Report what would be removed without deleting')
+    args = parser.parse_args()
+
+    from app import app, CACHE_INDEX
+
+    report = run_janitor(app.config, dry_run=args.dry_run, index=CACHE_INDEX)
+    for folder, stats in report.items():
+        print(f"{folder}: {stats['files_removed']} files, {stats['bytes_reclaimed']} bytes reclaimed")
+    print(f"Total reclaimed: {sum(s['bytes_reclaimed'] for s in report.values())} bytes")
@@ -0,0 +1,183 @@
+import json
+import time
+import uuid
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import tracing
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    status TEXT NOT NULL,
+    created REAL NOT NULL,
+    started REAL,
+    finished REAL,
+    result TEXT,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status);
+CREATE INDEX IF NOT EXISTS jobs_finished ON jobs (finished);
+
+-- Stage events, streamed to clients in id order
+CREATE TABLE IF NOT EXISTS events (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    job_id TEXT NOT NULL,
+    stage TEXT NOT NULL,
+    ts REAL NOT NULL,
+    data TEXT
+);
+CREATE INDEX IF NOT EXISTS events_job ON events (job_id, id);
+"""
+
+
+class QueueFull(Exception):
+    """Raised when the job queue is at capacity"""
+
+
+class JobStore:
+    """SQLite record of jobs, so any gunicorn worker can answer status queries"""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._local = threading.local()
+        self._connect().executescript(SCHEMA)
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=5.0, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def create(self, job_id, kind, created):
+        self._connect().execute(
+            "INSERT INTO jobs (id, kind, status, created) VALUES (?, ?, 'queued', ?)", (job_id, kind, created))
+
+    def update(self, job_id, **fields):
+        if 'result' in fields and fields['result'] is not None:
+            fields['result'] = json.dumps(fields['result'])
+        columns = ', '.join(f"{name} = ?" for name in fields)
+        self._connect().execute(f"UPDATE jobs SET {columns} WHERE id = ?", (*fields.values(), job_id))
+
+    def get(self, job_id):
+        """Return a job as a dict, or None"""
+        row = self._connect().execute(
+            'SELECT id, kind, status, created, started, finished, result, error FROM jobs WHERE id = ?',
+            (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(zip(('id', 'kind', 'status', 'created', 'started', 'finished', 'result', 'error'), row))
+        job['result'] = json.loads(job['result']) if job['result'] else None
+        job['timings'] = job_timings(job)
+        return job
+
+    def counts(self):
+        """Return the number of jobs in each status"""
+        rows = self._connect().execute('SELECT status, COUNT(*) FROM jobs GROUP BY status').fetchall()
+        return dict(rows)
+
+    def add_event(self, job_id, stage, **data):
+        """Record a pipeline stage event for a job"""
+        self._connect().execute(
+            'INSERT INTO events (job_id, stage, ts, data) VALUES (?, ?, ?, ?)',
+            (job_id, stage, time.time(), json.dumps(data)))
+
+    def events_since(self, job_id, after_id=0):
+        """Return a job's events with ids greater than after_id, oldest first"""
+        rows = self._connect().execute(
+            'SELECT id, stage, ts, data FROM events WHERE job_id = ? AND id > ? ORDER BY id',
+            (job_id, after_id)).fetchall()
+        return [{'id': row[0], 'stage': row[1], 'ts': row[2], **json.loads(row[3] or '{}')} for row in rows]
+
+    def prune(self, older_than):
+        """Forget finished jobs older than the given timestamp, with their events"""
+        conn = self._connect()
+        conn.execute('DELETE FROM events WHERE job_id IN (SELECT id FROM jobs WHERE finished < ?)', (older_than,))
+        conn.execute('DELETE FROM jobs WHERE finished < ?', (older_than,))
+
+
+def job_timings(job):
+    """Queue wait and run time of a job in milliseconds"""
+    timings = {}
+    if job['started'] is not None:
+        timings['queued_ms'] = (job['started'] - job['created']) * 1000
+        if job['finished'] is not None:
+            timings['run_ms'] = (job['finished'] - job['started']) * 1000
+    return timings
+
+
+class JobQueue:
+    """Bounded thread pool that runs try-on jobs in the background and records them in a JobStore"""
+
+    def __init__(self, store, workers=4, max_queue=100, ttl_seconds=3600):
+        self.store = store
+        self.workers = workers
+        self.max_queue = max_queue
+        self.ttl_seconds = ttl_seconds
+        self.queued = 0
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+        self.total_queued_ms = 0.0
+        self.total_run_ms = 0.0
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='tryon-job')
+        self._lock = threading.Lock()
+
+    def submit(self, kind, fn, *args, **kwargs):
+        """Queue fn(job_id, *args, **kwargs) and return the job id; fn's return value becomes the job result"""
+        with self._lock:
+            if self.queued >= self.max_queue:
+                raise QueueFull(f"Job queue is full ({self.max_queue} jobs waiting)")
+            self.queued += 1
+
+        job_id = uuid.uuid4().hex
+        created = time.time()
+        self.store.create(job_id, kind, created)
+        self.store.prune(created - self.ttl_seconds)
+        self._executor.submit(self._run, job_id, created, fn, args, kwargs)
+        return job_id
+
+    def _run(self, job_id, created, fn, args, kwargs):
+        started = time.time()
+        with self._lock:
+            self.queued -= 1
+            self.running += 1
+            self.total_queued_ms += (started - created) * 1000
+        self.store.update(job_id, status='running', started=started)
+
+        status = 'done'
+        try:
+            result = fn(job_id, *args, **kwargs)
+            self.store.update(job_id, status=status, finished=time.time(), result=result)
+        except Exception as e:
+            status = 'failed'
+            tracing.error('job_failed', exc_info=True, job_id=job_id, error=str(e))
+            self.store.update(job_id, status=status, finished=time.time(), error=str(e))
+        finally:
+            with self._lock:
+                self.running -= 1
+                self.total_run_ms += (time.time() - started) * 1000
+                if status == 'done':
+                    self.completed += 1
+                else:
+                    self.failed += 1
+
+    def stats(self):
+        """Queue depth, worker usage and average timings for this process"""
+        with self._lock:
+            finished = self.completed + self.failed
+            return {
+                'workers': self.workers,
+                'queue_depth': self.queued,
+                'max_queue': self.max_queue,
+                'running': self.running,
+                'completed': self.completed,
+                'failed': self.failed,
+                'avg_queued_ms': self.total_queued_ms / (finished + self.running) if finished + self.running else None,
+                'avg_run_ms': self.total_run_ms / finished if finished else None,
+            }
@@ -0,0 +1,58 @@
+import threading
+from collections import OrderedDict
+
+
+class MemoryCache:
+    """Bounded in-process LRU cache of result images, keyed by cache key"""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, cache_key):
+        """Return the cached bytes for a key, or None on a miss"""
+        with self._lock:
+            data = self._entries.get(cache_key)
+            if data is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(cache_key)
+            self.hits += 1
+            return data
+
+    def put(self, cache_key, data):
+        """Store bytes for a key, evicting least recently used entries to stay under max_bytes"""
+        size = len(data)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(cache_key, None)
+            if old is not None:
+                self.current_bytes -= len(old)
+            self._entries[cache_key] = data
+            self.current_bytes += size
+            while self.current_bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.current_bytes -= len(evicted)
+
+    def discard(self, cache_key):
+        """Drop a key from the cache if present"""
+        with self._lock:
+            old = self._entries.pop(cache_key, None)
+            if old is not None:
+                self.current_bytes -= len(old)
+
+    def stats(self):
+        """Return hit/miss counters and current usage"""
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'entries': len(self._entries),
+                'bytes': self.current_bytes,
+                'max_bytes': self.max_bytes,
+            }
@@ -0,0 +1,57 @@
+import os
+from prometheus_client import (CollectorRegistry, Counter, Gauge, Histogram, REGISTRY, CONTENT_TYPE_LATEST,
+                               generate_latest, multiprocess)
+from prometheus_client.core import GaugeMetricFamily
+
+# Under gunicorn every worker writes its samples to PROMETHEUS_MULTIPROC_DIR (see gunicorn.conf.py)
+# and /metrics merges them, so any worker can answer a scrape.
+if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+    # Set from .env for a single-process server, nothing else has created it
+    os.makedirs(os.environ['PROMETHEUS_MULTIPROC_DIR'], exist_ok=True)
+
+CACHE_LOOKUPS = Counter('tryon_cache_lookups_total', 'Result cache lookups by tier and outcome',
+                        ['tier', 'result'])
+UPSTREAM_REQUESTS = Counter('tryon_upstream_requests_total', 'Try-on API calls by method and HTTP status',
+                            ['method', 'status'])
+UPSTREAM_LATENCY = Histogram('tryon_upstream_latency_seconds', 'Try-on API call latency, until the response body',
+                             ['method'], buckets=(0.25, 0.5, 1, 2, 5, 10, 20, 30, 45, 60, 90, 120))
+FALLBACKS = Counter('tryon_fallbacks_total', 'Upstream calls that fell back from Method 1 to Method 2', ['mode'])
+DOWNLOAD_BYTES = Histogram('tryon_download_bytes', 'Size of downloaded result images', ['method'],
+                           buckets=(16e3, 64e3, 128e3, 256e3, 512e3, 1e6, 2e6, 4e6, 8e6))
+RESULT_BYTES = Counter('tryon_result_bytes_written_total', 'Bytes of upstream results written to the cache')
+REQUEST_LATENCY = Histogram('tryon_request_seconds', 'End-to-end latency of try-on requests and jobs', ['handler'],
+                            buckets=(0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 20, 30, 60, 120))
+IN_FLIGHT = Gauge('tryon_inflight_requests', 'Try-on requests and jobs being handled', ['handler'],
+                  multiprocess_mode='livesum')
+
+
+def cache_lookup(tier, hit):
+    CACHE_LOOKUPS.labels(tier, 'hit' if hit else 'miss').inc()
+
+
+class FolderUsageCollector:
+    """Disk usage gauges computed at scrape time, so they are the same whichever worker answers"""
+
+    def __init__(self, usage):
+        self.usage = usage
+
+    def collect(self):
+        size = GaugeMetricFamily('tryon_folder_bytes', 'Bytes stored in each static folder', labels=['folder'])
+        files = GaugeMetricFamily('tryon_folder_files', 'Files stored in each static folder', labels=['folder'])
+        for folder, (folder_bytes, folder_files) in self.usage.items():
+            size.add_metric([folder], folder_bytes)
+            files.add_metric([folder], folder_files)
+        yield size
+        yield files
+
+
+def render(usage):
+    """Prometheus text exposition of every metric plus the given {folder: (bytes, files)} usage"""
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    folders = CollectorRegistry()
+    folders.register(FolderUsageCollector(usage))
+    return generate_latest(registry) + generate_latest(folders)
@@ -0,0 +1,39 @@
+import os
+import argparse
+
+from app import app, CACHE_INDEX
+
+
+def remove_flat_cache(cache_folder, dry_run=False):
+    """Delete flat <key>.jpg cache entries left from before the sharded layout; returns (files, bytes)"""
+    removed = 0
+    reclaimed = 0
+    for entry in os.scandir(cache_folder):
+        if not entry.is_file() or entry.name.startswith('.') or not entry.name.endswith('.jpg'):
+            continue
+        size = entry.stat().st_size
+        if not dry_run:
+            try:
+                os.remove(entry.path)
+            except FileNotFoundError:
+                continue
+        removed += 1
+        reclaimed += size
+    return removed, reclaimed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Remove the flat cache entries left in static/cache by the pre-sharding layout',
+        epilog='Flat entries are keyed by MD5 over the raw upload bytes. Cache keys are now BLAKE2b over the '
+               'upload digests, so no request can hit those entries again; moving them into shards would only '
+               'keep dead files until eviction. Sharded entries are left alone.')
+    parser.add_argument('--dry-run', action='store_true', help='Report what would be removed without touching files')
+    args = parser.parse_args()
+
+    removed, reclaimed = remove_flat_cache(app.config['CACHE_FOLDER'], dry_run=args.dry_run)
+    print(f"{'Would remove' if args.dry_run else 'Removed'} {removed} legacy entries ({reclaimed} bytes)")
+
+    if removed and not args.dry_run:
+        # Index rows may still point at the flat paths
+        CACHE_INDEX.rebuild()
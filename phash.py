@@ -0,0 +1,112 @@
+import io
+import sqlite3
+import threading
+from PIL import Image
+
+BANDS = 8  # 8-bit bands of the model hash; any match within 7 bits shares at least one band
+MAX_THRESHOLD = BANDS - 1
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS phashes (
+    cache_key TEXT PRIMARY KEY,
+    category TEXT NOT NULL,
+    model_hash INTEGER NOT NULL,
+    garment_hash INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS phash_bands (
+    band INTEGER NOT NULL,
+    value INTEGER NOT NULL,
+    cache_key TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS phash_bands_lookup ON phash_bands (band, value);
+CREATE INDEX IF NOT EXISTS phash_bands_key ON phash_bands (cache_key);
+"""
+
+
+def dhash(data, size=8):
+    """64-bit difference hash of an image: survives re-encoding, resizing and metadata stripping"""
+    img = Image.open(io.BytesIO(data))
+    img.draft('L', (size * 8, size * 8))
+    img = img.convert('L').resize((size + 1, size), Image.BILINEAR)
+    pixels = list(img.getdata())
+    value = 0
+    for row in range(size):
+        for col in range(size):
+            left = pixels[row * (size + 1) + col]
+            right = pixels[row * (size + 1) + col + 1]
+            value = (value << 1) | (left > right)
+    return value
+
+
+def hamming(a, b):
+    return bin(a ^ b).count('1')
+
+
+def _to_signed(value):
+    # SQLite integers are signed 64-bit
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+
+def _to_unsigned(value):
+    return value + (1 << 64) if value < 0 else value
+
+
+def _bands(value):
+    return [(band, (value >> (band * 8)) & 0xFF) for band in range(BANDS)]
+
+
+class PerceptualIndex:
+    """Secondary cache index mapping perceptual hashes of a model/garment pair to a cache key"""
+
+    def __init__(self, db_path, threshold=4):
+        self.db_path = db_path
+        self.threshold = min(threshold, MAX_THRESHOLD)
+        self._local = threading.local()
+        self._connect().executescript(SCHEMA)
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=5.0, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            self._local.conn = conn
+        return conn
+
+    def add(self, cache_key, category, model_hash, garment_hash):
+        """Index a cached pair by its perceptual hashes"""
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute('DELETE FROM phash_bands WHERE cache_key = ?', (cache_key,))
+            conn.execute('INSERT OR REPLACE INTO phashes VALUES (?, ?, ?, ?)',
+                         (cache_key, category, _to_signed(model_hash), _to_signed(garment_hash)))
+            conn.executemany('INSERT INTO phash_bands (band, value, cache_key) VALUES (?, ?, ?)',
+                             [(band, value, cache_key) for band, value in _bands(model_hash)])
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def remove(self, cache_key):
+        """Drop a pair, e.g. after its cache entry was evicted"""
+        conn = self._connect()
+        conn.execute('DELETE FROM phash_bands WHERE cache_key = ?', (cache_key,))
+        conn.execute('DELETE FROM phashes WHERE cache_key = ?', (cache_key,))
+
+    def find(self, category, model_hash, garment_hash):
+        """Return (cache_key, distance) pairs within the threshold for both images, closest first"""
+        bands = _bands(model_hash)
+        clause = ' OR '.join(['(b.band = ? AND b.value = ?)'] * len(bands))
+        params = [v for pair in bands for v in pair]
+        rows = self._connect().execute(
+            'SELECT DISTINCT p.cache_key, p.model_hash, p.garment_hash FROM phash_bands b '
+            f'JOIN phashes p ON p.cache_key = b.cache_key WHERE ({clause}) AND p.category = ?',
+            (*params, category)).fetchall()
+
+        matches = []
+        for cache_key, candidate_model, candidate_garment in rows:
+            model_distance = hamming(model_hash, _to_unsigned(candidate_model))
+            garment_distance = hamming(garment_hash, _to_unsigned(candidate_garment))
+            if model_distance <= self.threshold and garment_distance <= self.threshold:
+                matches.append((cache_key, model_distance + garment_distance))
+        return sorted(matches, key=lambda match: match[1])
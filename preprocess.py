@@ -0,0 +1,29 @@
+import io
+from PIL import Image, ImageOps
+
+
+def normalize_image(data, max_side=1536, quality=90):
+    """Apply EXIF orientation, downscale to max_side and re-encode as a baseline JPEG"""
+    try:
+        img = Image.open(io.BytesIO(data))
+        # Let the JPEG decoder skip detail we are about to throw away
+        img.draft('RGB', (max_side, max_side))
+        img = ImageOps.exif_transpose(img)
+    except Exception as e:
+        raise ValueError(f"Unreadable image: {str(e)}")
+
+    if img.mode in ('RGBA', 'LA') or (img.mode == 'P' and 'transparency' in img.info):
+        # Flatten transparency onto white, as the upstream expects an opaque photo
+        rgba = img.convert('RGBA')
+        img = Image.new('RGB', rgba.size, (255, 255, 255))
+        img.paste(rgba, mask=rgba.getchannel('A'))
+    elif img.mode != 'RGB':
+        img = img.convert('RGB')
+
+    if max(img.size) > max_side:
+        img.thumbnail((max_side, max_side), Image.LANCZOS)
+
+    # No EXIF or other metadata is carried over, so equivalent uploads encode identically
+    out = io.BytesIO()
+    img.save(out, 'JPEG', quality=quality, optimize=True)
+    return out.getvalue()
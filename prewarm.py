@@ -0,0 +1,121 @@
+import os
+import csv
+import json
+import time
+import argparse
+import itertools
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from app import app, CACHE_INDEX, call_rapidapi_tryon, generate_cache_key, read_and_hash
+from rate_limit import RateLimitExceeded
+
+
+def load_manifest(path, default_category='Upper body'):
+    """Read (model, garment, category) pairs from a CSV, JSONL or JSON manifest
+
+    CSV and JSONL list one pair per row with model, garment and optional category columns.
+    A JSON object with "models" and "garments" lists expands to every model x garment pair.
+    """
+    base = os.path.dirname(os.path.abspath(path))
+
+    def resolve(p):
+        return p if os.path.isabs(p) else os.path.join(base, p)
+
+    with open(path, newline='') as f:
+        if path.endswith('.csv'):
+            rows = list(csv.DictReader(f))
+        elif path.endswith('.jsonl'):
+            rows = [json.loads(line) for line in f if line.strip()]
+        else:
+            manifest = json.load(f)
+            if isinstance(manifest, dict):
+                category = manifest.get('category', default_category)
+                rows = [{'model': m, 'garment': g, 'category': category}
+                        for m, g in itertools.product(manifest['models'], manifest['garments'])]
+            else:
+                rows = manifest
+
+    return [(resolve(row['model']), resolve(row['garment']), row.get('category') or default_category)
+            for row in rows]
+
+
+class ImageDigests:
+    """Hash each image file once per run, however many pairs it appears in"""
+
+    def __init__(self):
+        self._images = {}
+        self._lock = threading.Lock()
+
+    def get(self, path):
+        with self._lock:
+            image = self._images.get(path)
+        if image is None:
+            image = read_and_hash(path)
+            with self._lock:
+                self._images[path] = image
+        return image
+
+
+def warm_pair(images, model_path, garment_path, category):
+    """Fill the cache for one pair; returns 'skipped', 'warmed' or 'missed'"""
+    model_image = images.get(model_path)
+    garment_image = images.get(garment_path)
+    cache_key = generate_cache_key(model_image.digest, garment_image.digest, str(category))
+
+    # Incremental: pairs from earlier or interrupted runs are already in the cache
+    entry = CACHE_INDEX.lookup(cache_key)
+    if entry is not None and os.path.exists(entry.path):
+        return 'skipped'
+
+    result_path = call_rapidapi_tryon(model_path, garment_path, category,
+                                      model_image=model_image, garment_image=garment_image)
+    # Pre-warming only needs the cache entry, not a per-request result link
+    if os.path.dirname(result_path) == app.config['RESULT_FOLDER'] and os.path.exists(result_path):
+        os.remove(result_path)
+    return 'warmed' if CACHE_INDEX.lookup(cache_key) is not None else 'missed'
+
+
+def prewarm(pairs, concurrency=2):
+    """Run every pair through the try-on pipeline with at most `concurrency` upstream calls at once"""
+    images = ImageDigests()
+    counts = {'skipped': 0, 'warmed': 0, 'missed': 0, 'failed': 0, 'rate_limited': 0}
+    started = time.time()
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        futures = {pool.submit(warm_pair, images, *pair): pair for pair in pairs}
+        for done, future in enumerate(as_completed(futures), 1):
+            model_path, garment_path, category = futures[future]
+            try:
+                outcome = future.result()
+            except RateLimitExceeded as e:
+                outcome = 'rate_limited'
+                print(f"Rate limited on {model_path} x {garment_path}: {str(e)}")
+            except Exception as e:
+                outcome = 'failed'
+                print(f"Failed {model_path} x {garment_path}: {str(e)}")
+            counts[outcome] += 1
+            print(f"[{done}/{len(pairs)}] {outcome}: {os.path.basename(model_path)} x "
+                  f"{os.path.basename(garment_path)} ({category})")
+
+    counts['elapsed_seconds'] = round(time.time() - started, 1)
+    return counts
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Pre-warm the try-on cache from a manifest of model x garment pairs')
+    parser.add_argument('manifest', help='CSV, JSONL or JSON manifest of pairs')
+    parser.add_argument('--concurrency', type=int, default=2, help='Maximum parallel upstream calls')
+    parser.add_argument('--max-wait', type=float, default=3600,
+                        help='Seconds a pair may wait for the shared rate limiter before it is skipped')
+    parser.add_argument('--category', default='Upper body', help='Category for rows that do not set one')
+    args = parser.parse_args()
+
+    # Queue on the shared rate limiter instead of failing fast like interactive requests
+    app.config['RATE_LIMIT_MAX_WAIT'] = args.max_wait
+
+    pairs = load_manifest(args.manifest, args.category)
+    print(f"Pre-warming {len(pairs)} pairs with concurrency {args.concurrency}")
+    summary = prewarm(pairs, args.concurrency)
+    print(json.dumps(summary, indent=2))
+    print("Re-run the same manifest to resume; cached pairs are skipped.")
@@ -0,0 +1,86 @@
+import os
+import json
+import math
+import time
+import threading
+
+try:
+    import fcntl
+except ImportError:
+    # No flock on Windows; the bucket is then shared only between threads of one process
+    fcntl = None
+
+
+class RateLimitExceeded(Exception):
+    """Raised when no upstream call may be made within the allowed wait"""
+
+    def __init__(self, retry_after):
+        self.retry_after = retry_after
+        super().__init__(f"Rate limit exceeded, retry in {math.ceil(retry_after)} seconds")
+
+
+class TokenBucket:
+    """Token bucket shared across processes through a small JSON state file"""
+
+    def __init__(self, state_file, rate, burst):
+        self.state_file = state_file
+        self.rate = rate  # tokens per second; 0 disables the limiter
+        self.burst = max(1, burst)
+        self._lock = threading.Lock()
+
+    def try_acquire(self, now=None):
+        """Take a token if one is available; return (acquired, seconds until the next token)"""
+        if self.rate <= 0:
+            return True, 0.0
+
+        with self._lock:
+            fd = os.open(self.state_file, os.O_CREAT | os.O_RDWR, 0o644)
+            try:
+                if fcntl is not None:
+                    fcntl.flock(fd, fcntl.LOCK_EX)
+                now = time.time() if now is None else now
+                tokens = self._refill(self._read_state(fd), now)
+                if tokens >= 1:
+                    self._write_state(fd, tokens - 1, now)
+                    return True, 0.0
+                self._write_state(fd, tokens, now)
+                return False, (1 - tokens) / self.rate
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(fd, fcntl.LOCK_UN)
+                os.close(fd)
+
+    def acquire(self, max_wait=0.0):
+        """Take a token, waiting up to max_wait seconds, or raise RateLimitExceeded"""
+        deadline = time.time() + max_wait
+        while True:
+            acquired, retry_after = self.try_acquire()
+            if acquired:
+                return
+            if time.time() + retry_after > deadline:
+                raise RateLimitExceeded(retry_after)
+            time.sleep(retry_after)
+
+    def _refill(self, state, now):
+        # Older state files only carry the timestamp of the last call, i.e. an empty bucket
+        tokens = state.get('tokens', 0.0 if 'timestamp' in state else self.burst)
+        elapsed = max(0.0, now - state.get('timestamp', now))
+        return min(self.burst, tokens + elapsed * self.rate)
+
+    def _read_state(self, fd):
+        os.lseek(fd, 0, os.SEEK_SET)
+        raw = b''
+        while True:
+            chunk = os.read(fd, 4096)
+            if not chunk:
+                break
+            raw += chunk
+        try:
+            return json.loads(raw) if raw else {}
+        except ValueError:
+            return {}
+
+    def _write_state(self, fd, tokens, now):
+        os.lseek(fd, 0, os.SEEK_SET)
+        os.ftruncate(fd, 0)
+        os.write(fd, json.dumps({'timestamp': now, 'tokens': tokens}).encode('utf-8'))
@@ -0,0 +1,136 @@
+import io
+import json
+import time
+import random
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from PIL import Image
+
+from benchmark import RESULTS_FOLDER, scrape, summarize, save_result
+
+
+def load_capture(path):
+    """Captured try-on records in arrival order; lines written by anything else are skipped"""
+    records = []
+    with open(path) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if isinstance(record, dict) and 'model_digest' in record and 'garment_digest' in record:
+                records.append(record)
+    return sorted(records, key=lambda record: record['ts'])
+
+
+class ImageSynthesizer:
+    """One deterministic stand-in JPEG per captured digest, close to the captured size
+
+    Equal digests get equal bytes, so the replayed cache hit pattern follows the captured one.
+    """
+
+    def __init__(self, quality=90):
+        self.quality = quality
+        self._images = {}
+        self._lock = threading.Lock()
+        # Random noise barely compresses, so bytes per pixel is close to constant
+        self.bytes_per_pixel = len(self._encode(random.Random('calibrate'), 256)) / (256 * 256)
+
+    def _encode(self, rng, side):
+        img = Image.frombytes('RGB', (side, side), rng.randbytes(side * side * 3))
+        out = io.BytesIO()
+        img.save(out, 'JPEG', quality=self.quality)
+        return out.getvalue()
+
+    def get(self, digest, size):
+        with self._lock:
+            data = self._images.get(digest)
+        if data is None:
+            side = max(16, int((size / self.bytes_per_pixel) ** 0.5))
+            data = self._encode(random.Random(digest), side)
+            with self._lock:
+                self._images[digest] = data
+        return data
+
+
+def replay(base_url, records, speed=1.0, concurrency=16):
+    """Re-send captured requests with their original spacing divided by `speed` (0 sends them back to back)"""
+    images = ImageSynthesizer()
+    local = threading.local()
+    latencies, statuses = [], {}
+    lock = threading.Lock()
+
+    def one(record):
+        session = getattr(local, 'session', None)
+        if session is None:
+            session = local.session = requests.Session()
+        files = {'model_image': ('model.jpg', images.get(record['model_digest'], record['model_bytes']),
+                                 'image/jpeg'),
+                 'garment_image': ('garment.jpg', images.get(record['garment_digest'], record['garment_bytes']),
+                                   'image/jpeg')}
+        started = time.perf_counter()
+        try:
+            status = str(session.post(f"{base_url}/try-on", files=files, data={'category': record['category']},
+                                      allow_redirects=False, timeout=300).status_code)
+        except requests.RequestException as e:
+            status = type(e).__name__
+        latency_ms = (time.perf_counter() - started) * 1000
+        with lock:
+            latencies.append((status, latency_ms))
+            statuses[status] = statuses.get(status, 0) + 1
+
+    before = scrape(base_url)
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for record in records:
+            if speed > 0:
+                delay = (record['ts'] - records[0]['ts']) / speed - (time.perf_counter() - started)
+                if delay > 0:
+                    time.sleep(delay)
+            pool.submit(one, record)
+    elapsed = time.perf_counter() - started
+    after = scrape(base_url)
+    return latencies, statuses, elapsed, before, after
+
+
+def captured_summary(records):
+    """The captured run's own outcome mix, to set beside the replay's"""
+    outcomes, methods = {}, {}
+    for record in records:
+        outcomes[record.get('cache') or 'none'] = outcomes.get(record.get('cache') or 'none', 0) + 1
+        if record.get('method'):
+            methods[record['method']] = methods.get(record['method'], 0) + 1
+    hits = sum(count for outcome, count in outcomes.items() if outcome not in ('miss', 'none'))
+    looked_up = hits + outcomes.get('miss', 0)
+    return {'requests': len(records), 'cache_outcomes': outcomes, 'methods': methods,
+            'hit_ratio': round(hits / looked_up, 4) if looked_up else None,
+            'duration_seconds': round(records[-1]['ts'] - records[0]['ts'], 3) if records else 0}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Replay captured /try-on traffic (CAPTURE_ENABLED=1) against a local instance',
+        epilog='Uploads are synthesized per captured digest, so repeats and cache hits follow the captured mix. '
+               'Async requests are replayed synchronously.')
+    parser.add_argument('capture', nargs='?', default='requests.jsonl', help='Capture file written by the app')
+    parser.add_argument('--url', default='http://127.0.0.1:5000', help='Base URL of the app under test')
+    parser.add_argument('--speed', type=float, default=1.0,
+                        help='Replay speed multiplier; 0 sends requests as fast as concurrency allows')
+    parser.add_argument('--concurrency', type=int, default=16, help='Most requests in flight at once')
+    parser.add_argument('--limit', type=int, default=None, help='Replay only the first N captured requests')
+    parser.add_argument('--label', default='replay', help='Name for this run in saved results and comparisons')
+    parser.add_argument('--output', default=RESULTS_FOLDER, help='Folder to save the JSON result in')
+    args = parser.parse_args()
+
+    records = load_capture(args.capture)[:args.limit]
+    captured = captured_summary(records)
+    print(f"Replaying {len(records)} requests captured over {captured['duration_seconds']}s "
+          f"at {args.speed}x to {args.url}")
+    summary = summarize(*replay(args.url.rstrip('/'), records, args.speed, args.concurrency))
+    summary['captured'] = captured
+    config = {k: v for k, v in vars(args).items() if k != 'output'}
+    print(json.dumps(summary, indent=2))
+    print(f"Saved to {save_result(args.label, config, summary, args.output)}")
@@ -0,0 +1,173 @@
+import os
+import time
+import asyncio
+import threading
+from contextlib import asynccontextmanager, contextmanager
+
+import tracing
+
+try:
+    import fcntl
+except ImportError:
+    # No flock on Windows; coalescing then only works within one process
+    fcntl = None
+
+
+class _Call:
+    """An in-progress call that followers wait on"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Run at most one call per key at a time; concurrent callers for the same key share its outcome
+
+    Within a process, followers wait on the leader's thread (or, with do_async, the leader's
+    task). Across processes, leaders serialize on a per-key lock file, so the callable should
+    re-check the cache first.
+    """
+
+    def __init__(self, lock_folder=None, lock_timeout=120.0, poll_interval=0.05):
+        self.lock_folder = lock_folder if fcntl is not None else None
+        self.lock_timeout = lock_timeout
+        self.poll_interval = poll_interval
+        self.leaders = 0
+        self.coalesced = 0
+        self._calls = {}
+        self._tasks = {}
+        self._lock = threading.Lock()
+        if self.lock_folder:
+            os.makedirs(self.lock_folder, exist_ok=True)
+
+    def do(self, key, fn):
+        """Call fn() for key, or wait for the call already in flight and return its result"""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+                self.leaders += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            with self._process_lock(key):
+                call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    async def do_async(self, key, fn):
+        """do() for a coroutine function: callers on the event loop await the leader's task"""
+        with self._lock:
+            task = self._tasks.get(key)
+            if task is None:
+                task = asyncio.ensure_future(self._lead_async(key, fn))
+                self._tasks[key] = task
+                task.add_done_callback(lambda _: self._tasks.pop(key, None))
+                self.leaders += 1
+            else:
+                self.coalesced += 1
+        # A caller whose client disconnects must not cancel the call the others are waiting on
+        return await asyncio.shield(task)
+
+    async def _lead_async(self, key, fn):
+        async with self._process_lock_async(key):
+            return await fn()
+
+    @contextmanager
+    def _process_lock(self, key):
+        if not self.lock_folder:
+            yield
+            return
+
+        path = os.path.join(self.lock_folder, f"{key}.lock")
+        fd = self._acquire_file_lock(path)
+        try:
+            yield
+        finally:
+            self._release_file_lock(path, fd)
+
+    @asynccontextmanager
+    async def _process_lock_async(self, key):
+        if not self.lock_folder:
+            yield
+            return
+
+        # Polled on the event loop, so a wait on another process does not hold a thread
+        path = os.path.join(self.lock_folder, f"{key}.lock")
+        deadline = time.time() + self.lock_timeout
+        while True:
+            fd = self._try_file_lock(path)
+            if fd is not None or self._lock_timed_out(path, deadline):
+                break
+            await asyncio.sleep(self.poll_interval)
+        try:
+            yield
+        finally:
+            self._release_file_lock(path, fd)
+
+    def _acquire_file_lock(self, path):
+        deadline = time.time() + self.lock_timeout
+        while True:
+            fd = self._try_file_lock(path)
+            if fd is not None or self._lock_timed_out(path, deadline):
+                return fd
+            time.sleep(self.poll_interval)
+
+    def _lock_timed_out(self, path, deadline):
+        if time.time() <= deadline:
+            return False
+        # Better a duplicate upstream call than a stuck worker
+        tracing.warning('single_flight_lock_timeout', lock=path)
+        return True
+
+    def _try_file_lock(self, path):
+        """Take the lock file without blocking; None if another process holds it"""
+        while True:
+            fd = os.open(path, os.O_CREAT | os.O_RDWR, 0o644)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                os.close(fd)
+                return None
+            try:
+                if os.stat(path).st_ino == os.fstat(fd).st_ino:
+                    return fd
+            except FileNotFoundError:
+                pass
+            # The previous holder removed the file after we opened it
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
+
+    def _release_file_lock(self, path, fd):
+        if fd is None:
+            return
+        # Unlink before unlocking; waiters notice the inode changed and retry
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        os.close(fd)
+
+    def stats(self):
+        """Return leader/follower counters"""
+        with self._lock:
+            return {'leaders': self.leaders, 'coalesced': self.coalesced,
+                    'in_flight': len(self._calls) + len(self._tasks)}
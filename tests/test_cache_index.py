@@ -0,0 +1,66 @@
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cache_index import CacheIndex
+
+
+class CacheIndexTotalsTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.folder, 'cache_index.db')
+        self.index = CacheIndex(self.db_path, os.path.join(self.folder, 'cache'))
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def table_totals(self):
+        entries, size = self.index._connect().execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries').fetchone()
+        return entries, size
+
+    def test_re_add_replaces_the_entry_in_totals(self):
+        for _ in range(3):
+            self.index.add('k', 'p', 100)
+        self.index.add('k', 'p', 250)
+        stats = self.index.stats()
+        self.assertEqual((stats['entries'], stats['bytes']), (1, 250))
+        self.assertEqual(self.table_totals(), (1, 250))
+
+    def test_re_add_resets_hits(self):
+        self.index.add('k', 'p', 100)
+        self.index.record_hit('k')
+        self.index.record_hit('k')
+        self.assertEqual(self.index.stats()['hits'], 2)
+        self.index.add('k', 'p', 100)
+        self.assertEqual(self.index.stats()['hits'], 0)
+
+    def test_record_hit_reports_a_missing_or_different_entry(self):
+        self.index.add('k', 'p', 100)
+        self.assertTrue(self.index.record_hit('k'))
+        self.assertTrue(self.index.record_hit('k', size=100))
+        self.assertFalse(self.index.record_hit('k', size=99))
+        self.assertFalse(self.index.record_hit('missing'))
+        self.assertEqual(self.index.stats()['hits'], 2)
+
+    def test_remove_after_re_add(self):
+        self.index.add('a', 'pa', 100)
+        self.index.add('a', 'pa', 100)
+        self.index.add('b', 'pb', 40)
+        self.index.remove('a')
+        self.assertEqual(self.index.stats(), {'entries': 1, 'bytes': 40, 'hits': 0})
+        self.index.remove('b')
+        self.assertEqual(self.index.stats(), {'entries': 0, 'bytes': 0, 'hits': 0})
+
+    def test_reopening_repairs_drifted_totals(self):
+        self.index.add('k', 'p', 100)
+        self.index._connect().execute('UPDATE totals SET entries = 3, bytes = 300 WHERE id = 0')
+        reopened = CacheIndex(self.db_path, os.path.join(self.folder, 'cache'))
+        self.assertEqual(reopened.stats(), {'entries': 1, 'bytes': 100, 'hits': 0})
+
+
+if __name__ == '__main__':
+    unittest.main()
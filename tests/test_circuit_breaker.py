@@ -0,0 +1,77 @@
+import os
+import sys
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpen
+
+
+class CircuitBreakerTest(unittest.TestCase):
+    def setUp(self):
+        self.breaker = CircuitBreaker(failure_threshold=3, reset_timeout=0.1)
+
+    def fail(self, times):
+        for _ in range(times):
+            self.breaker.before_call()
+            self.breaker.record_failure()
+
+    def open_and_wait(self):
+        self.fail(3)
+        time.sleep(0.15)
+
+    def test_opens_after_consecutive_failures(self):
+        self.fail(2)
+        self.assertEqual(self.breaker.state, CLOSED)
+        self.fail(1)
+        self.assertEqual(self.breaker.state, OPEN)
+        with self.assertRaises(CircuitOpen) as raised:
+            self.breaker.before_call()
+        self.assertLessEqual(raised.exception.retry_after, 0.1)
+        self.assertEqual(self.breaker.stats()['times_opened'], 1)
+
+    def test_success_resets_the_failure_count(self):
+        self.fail(2)
+        self.breaker.record_success()
+        self.fail(2)
+        self.assertEqual(self.breaker.state, CLOSED)
+
+    def test_half_open_admits_a_single_trial(self):
+        self.open_and_wait()
+        self.breaker.check()
+        self.assertEqual(self.breaker.stats()['state'], HALF_OPEN)
+
+        # check() does not claim the trial; the first before_call() does, and everyone else is refused
+        self.breaker.check()
+        self.breaker.before_call()
+        with self.assertRaises(CircuitOpen):
+            self.breaker.before_call()
+        with self.assertRaises(CircuitOpen):
+            self.breaker.check()
+        self.assertEqual(self.breaker.stats()['rejected'], 2)
+
+    def test_successful_trial_closes(self):
+        self.open_and_wait()
+        self.breaker.before_call()
+        self.breaker.record_success()
+        self.assertEqual(self.breaker.state, CLOSED)
+        self.breaker.before_call()
+        self.breaker.before_call()
+
+    def test_failed_trial_reopens(self):
+        self.open_and_wait()
+        self.breaker.before_call()
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, OPEN)
+        self.assertEqual(self.breaker.stats()['times_opened'], 2)
+        with self.assertRaises(CircuitOpen):
+            self.breaker.before_call()
+
+        time.sleep(0.15)
+        self.breaker.before_call()
+        self.assertEqual(self.breaker.state, HALF_OPEN)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,54 @@
+import os
+import sys
+import time
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from janitor import FolderQuota, sweep_folder
+
+
+class ResultSweepTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.cache = os.path.join(self.folder, 'cache')
+        self.results = os.path.join(self.folder, 'results')
+        os.makedirs(self.cache)
+        os.makedirs(self.results)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def write(self, path, size, age):
+        with open(path, 'wb') as f:
+            f.write(b'x' * size)
+        then = time.time() - age
+        os.utime(path, (then, then))
+
+    def test_fresh_link_to_an_old_cache_entry_is_kept(self):
+        entry = os.path.join(self.cache, 'k.jpg')
+        self.write(entry, 100, 2 * 86400)
+        os.link(entry, os.path.join(self.results, 'result_new.jpg'))
+
+        removed, reclaimed = sweep_folder(self.results, FolderQuota(None, None, 86400))
+        self.assertEqual((removed, reclaimed), (0, 0))
+        self.assertTrue(os.path.exists(os.path.join(self.results, 'result_new.jpg')))
+
+    def test_shared_bytes_do_not_count_toward_the_quota(self):
+        entry = os.path.join(self.cache, 'k.jpg')
+        self.write(entry, 100, 0)
+        os.link(entry, os.path.join(self.results, 'result_linked.jpg'))
+        self.write(os.path.join(self.results, 'result_own.jpg'), 100, 0)
+
+        removed, reclaimed = sweep_folder(self.results, FolderQuota(150, None, None))
+        self.assertEqual((removed, reclaimed), (0, 0))
+
+        removed, reclaimed = sweep_folder(self.results, FolderQuota(50, None, None))
+        self.assertEqual(reclaimed, 100)
+        self.assertTrue(os.path.exists(os.path.join(self.results, 'result_linked.jpg')))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+import os
+import sys
+import time
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from rate_limit import RateLimitExceeded, TokenBucket
+
+
+class TokenBucketTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.state_file = os.path.join(self.folder, 'rate_limit_state.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_burst_then_refill(self):
+        bucket = TokenBucket(self.state_file, rate=0.5, burst=3)
+        now = 1000.0
+        self.assertEqual([bucket.try_acquire(now)[0] for _ in range(3)], [True, True, True])
+
+        acquired, retry_after = bucket.try_acquire(now)
+        self.assertFalse(acquired)
+        self.assertAlmostEqual(retry_after, 2.0)
+
+        # One token back after 1 / rate seconds, never more than the burst however long it sits idle
+        self.assertEqual(bucket.try_acquire(now + 2.0), (True, 0.0))
+        self.assertFalse(bucket.try_acquire(now + 2.0)[0])
+        self.assertEqual([bucket.try_acquire(now + 1000)[0] for _ in range(4)], [True, True, True, False])
+
+    def test_partial_refill_shortens_retry_after(self):
+        bucket = TokenBucket(self.state_file, rate=1, burst=1)
+        bucket.try_acquire(1000.0)
+        acquired, retry_after = bucket.try_acquire(1000.25)
+        self.assertFalse(acquired)
+        self.assertAlmostEqual(retry_after, 0.75)
+
+    def test_instances_share_the_state_file(self):
+        now = 1000.0
+        first = TokenBucket(self.state_file, rate=1, burst=2)
+        second = TokenBucket(self.state_file, rate=1, burst=2)
+        self.assertTrue(first.try_acquire(now)[0])
+        self.assertTrue(second.try_acquire(now)[0])
+        self.assertFalse(first.try_acquire(now)[0])
+
+    def test_acquire_raises_when_the_wait_is_too_long(self):
+        bucket = TokenBucket(self.state_file, rate=0.5, burst=1)
+        bucket.acquire()
+        with self.assertRaises(RateLimitExceeded) as raised:
+            bucket.acquire(max_wait=0.5)
+        self.assertGreater(raised.exception.retry_after, 1.5)
+        self.assertLessEqual(raised.exception.retry_after, 2.0)
+        self.assertIn('retry in 2 seconds', str(raised.exception))
+
+    def test_acquire_waits_for_the_next_token(self):
+        bucket = TokenBucket(self.state_file, rate=20, burst=1)
+        bucket.acquire()
+        started = time.time()
+        bucket.acquire(max_wait=1.0)
+        self.assertGreaterEqual(time.time() - started, 0.03)
+
+    def test_zero_rate_disables_the_limit(self):
+        bucket = TokenBucket(self.state_file, rate=0, burst=1)
+        self.assertEqual([bucket.try_acquire() for _ in range(3)], [(True, 0.0)] * 3)
+        self.assertFalse(os.path.exists(self.state_file))
+
+
+if __name__ == '__main__':
+    unittest.main()
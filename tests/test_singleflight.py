@@ -0,0 +1,166 @@
+import os
+import sys
+import time
+import shutil
+import asyncio
+import tempfile
+import threading
+import unittest
+import multiprocessing
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import singleflight
+from singleflight import SingleFlight
+
+
+def hold_lock(lock_folder, key, held, seconds):
+    """Child process: lead a call for key and keep its lock file for a while"""
+    def call():
+        held.set()
+        time.sleep(seconds)
+    SingleFlight(lock_folder).do(key, call)
+
+
+class CoalescingTest(unittest.TestCase):
+    def setUp(self):
+        self.flight = SingleFlight()
+        self.entered = threading.Event()
+        self.release = threading.Event()
+
+    def leader(self, outcome):
+        def call():
+            self.entered.set()
+            self.release.wait(5)
+            if isinstance(outcome, Exception):
+                raise outcome
+            return outcome
+        return call
+
+    def follow(self, results):
+        def run():
+            try:
+                results.append(self.flight.do('k', lambda: 'follower ran'))
+            except Exception as e:
+                results.append(e)
+        thread = threading.Thread(target=run)
+        thread.start()
+        # The follower must have joined the call before the leader finishes
+        deadline = time.time() + 5
+        while self.flight.stats()['coalesced'] == 0 and time.time() < deadline:
+            time.sleep(0.01)
+        return thread
+
+    def test_follower_gets_the_leaders_result(self):
+        results = []
+        leader = threading.Thread(target=lambda: results.append(self.flight.do('k', self.leader('result'))))
+        leader.start()
+        self.assertTrue(self.entered.wait(5))
+        follower = self.follow(results)
+        self.release.set()
+        leader.join(5)
+        follower.join(5)
+
+        self.assertEqual(results, ['result', 'result'])
+        self.assertEqual(self.flight.stats(), {'leaders': 1, 'coalesced': 1, 'in_flight': 0})
+
+    def test_follower_gets_the_leaders_error(self):
+        error = ValueError('upstream failed')
+        results = []
+
+        def lead():
+            try:
+                self.flight.do('k', self.leader(error))
+            except ValueError as e:
+                results.append(e)
+        leader = threading.Thread(target=lead)
+        leader.start()
+        self.assertTrue(self.entered.wait(5))
+        follower = self.follow(results)
+        self.release.set()
+        leader.join(5)
+        follower.join(5)
+
+        self.assertEqual(results, [error, error])
+
+    def test_next_call_after_completion_runs_again(self):
+        self.assertEqual(self.flight.do('k', lambda: 1), 1)
+        self.assertEqual(self.flight.do('k', lambda: 2), 2)
+        self.assertEqual(self.flight.stats()['leaders'], 2)
+
+    def test_async_followers_share_the_leaders_task(self):
+        calls = []
+
+        async def call():
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            return 'result'
+
+        async def run():
+            return await asyncio.gather(*(self.flight.do_async('k', call) for _ in range(5)))
+
+        self.assertEqual(asyncio.run(run()), ['result'] * 5)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(self.flight.stats(), {'leaders': 1, 'coalesced': 4, 'in_flight': 0})
+
+
+@unittest.skipIf(singleflight.fcntl is None, 'needs flock')
+class ProcessLockTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_lock_passes_to_the_next_process_after_unlink(self):
+        context = multiprocessing.get_context('fork')
+        held = context.Event()
+        child = context.Process(target=hold_lock, args=(self.folder, 'k', held, 0.3))
+        child.start()
+        try:
+            self.assertTrue(held.wait(5))
+            started = time.time()
+            ran_at = SingleFlight(self.folder).do('k', time.time)
+        finally:
+            child.join(5)
+
+        # Only once the other process released the lock, and nothing left behind
+        self.assertGreaterEqual(ran_at - started, 0.2)
+        self.assertEqual(child.exitcode, 0)
+        self.assertEqual(os.listdir(self.folder), [])
+
+    def test_async_leader_waits_for_the_other_process(self):
+        context = multiprocessing.get_context('fork')
+        held = context.Event()
+        child = context.Process(target=hold_lock, args=(self.folder, 'k', held, 0.3))
+        child.start()
+        try:
+            self.assertTrue(held.wait(5))
+            started = time.time()
+
+            async def call():
+                return time.time()
+            ran_at = asyncio.run(SingleFlight(self.folder).do_async('k', call))
+        finally:
+            child.join(5)
+
+        self.assertGreaterEqual(ran_at - started, 0.2)
+        self.assertEqual(os.listdir(self.folder), [])
+
+    def test_gives_up_on_the_lock_after_the_timeout(self):
+        holder = SingleFlight(self.folder)
+        entered = threading.Event()
+        release = threading.Event()
+        thread = threading.Thread(target=holder.do, args=('k', lambda: (entered.set(), release.wait(5))))
+        thread.start()
+        try:
+            self.assertTrue(entered.wait(5))
+            # flock locks belong to the open file, so a second instance contends even within one process
+            self.assertEqual(SingleFlight(self.folder, lock_timeout=0.1).do('k', lambda: 'ran anyway'), 'ran anyway')
+        finally:
+            release.set()
+            thread.join(5)
+
+
+if __name__ == '__main__':
+    unittest.main()
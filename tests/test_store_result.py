@@ -0,0 +1,128 @@
+import os
+import sys
+import time
+import shutil
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Keep the app's background work and state files out of the way; load_dotenv() does not override these
+os.environ['JANITOR_INTERVAL_SECONDS'] = '0'
+os.environ.setdefault('CACHE_INDEX_PATH', os.path.join(tempfile.gettempdir(), 'tryon_test_cache_index.db'))
+os.environ.setdefault('JOB_DB_PATH', os.path.join(tempfile.gettempdir(), 'tryon_test_jobs.db'))
+
+import app as tryon
+from cache_index import CacheIndex
+from memory_cache import MemoryCache
+
+
+class StoreTestCase(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        cache = os.path.join(self.folder, 'cache')
+        results = os.path.join(self.folder, 'results')
+        os.makedirs(results)
+        self.index = CacheIndex(os.path.join(self.folder, 'cache_index.db'), cache)
+        self.memory = MemoryCache(1024 * 1024)
+        patches = [mock.patch.dict(tryon.app.config, CACHE_FOLDER=cache, RESULT_FOLDER=results),
+                   mock.patch.object(tryon, 'CACHE_INDEX', self.index),
+                   mock.patch.object(tryon, 'MEMORY_CACHE', self.memory)]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def cached_bytes(self, cache_key):
+        with open(tryon.cache_file_path(cache_key), 'rb') as f:
+            return f.read()
+
+
+class StoreResultTest(StoreTestCase):
+    def test_second_store_keeps_the_first_entry(self):
+        first, _ = tryon.store_result('k', (b'first',), time.time(), 'primary')
+        second, size = tryon.store_result('k', (b'second',), time.time(), 'alt')
+
+        self.assertEqual(self.cached_bytes('k'), b'first')
+        self.assertEqual(size, len(b'first'))
+        self.assertEqual(self.index.lookup('k').method, 'primary')
+        self.assertEqual(self.index.stats()['entries'], 1)
+        with open(second, 'rb') as f:
+            self.assertEqual(f.read(), b'first')
+        self.assertEqual([name for name in os.listdir(os.path.dirname(tryon.cache_file_path('k')))], ['k.jpg'])
+
+    def test_unindexed_file_is_adopted(self):
+        tryon.write_atomic(tryon.cache_file_path('k'), b'leftover')
+        tryon.store_result('k', (b'new',), time.time(), 'primary')
+        self.assertEqual(self.cached_bytes('k'), b'leftover')
+        self.assertEqual(self.index.lookup('k').size, len(b'leftover'))
+
+
+class ReferenceCachedResultTest(StoreTestCase):
+    def test_second_hit_is_served_from_memory(self):
+        tryon.store_result('k', (b'image',), time.time(), 'primary')
+        self.assertNotEqual(tryon.reference_cached_result('k'), 'cache/k.jpg')
+        self.assertEqual(tryon.reference_cached_result('k'), 'cache/k.jpg')
+        self.assertEqual(self.index.lookup('k').hits, 2)
+        self.assertEqual((self.memory.stats()['hits'], self.memory.stats()['misses']), (1, 1))
+
+    def test_evicted_entry_is_not_served_from_memory(self):
+        tryon.store_result('k', (b'image',), time.time(), 'primary')
+        tryon.reference_cached_result('k')
+        os.remove(tryon.cache_file_path('k'))
+        self.index.remove('k')
+
+        self.assertIsNone(tryon.reference_cached_result('k'))
+        self.assertEqual(self.memory.stats()['entries'], 0)
+
+    def test_replaced_entry_is_reloaded_from_disk(self):
+        tryon.store_result('k', (b'old',), time.time(), 'primary')
+        tryon.reference_cached_result('k')
+        os.remove(tryon.cache_file_path('k'))
+        self.index.remove('k')
+        tryon.store_result('k', (b'newer',), time.time(), 'alt')
+
+        result_path = tryon.reference_cached_result('k')
+        with open(result_path, 'rb') as f:
+            self.assertEqual(f.read(), b'newer')
+        self.assertEqual(self.memory.get('k'), b'newer')
+
+
+class HedgeLoserTest(StoreTestCase):
+    def method(self, name, delay, finished=None):
+        def call(cache_key, model_image, garment_image, progress=None):
+            try:
+                time.sleep(delay)
+                result_path, _ = tryon.store_result(cache_key, (name.encode(),), time.time(), name)
+                return result_path
+            finally:
+                if finished is not None:
+                    finished.set()
+        return call
+
+    def test_losing_call_does_not_replace_the_winner(self):
+        hedger = mock.Mock()
+        hedger.delay.return_value = 0.05
+        limiter = mock.Mock()
+        limiter.try_acquire.return_value = (True, 0)
+        alt_finished = threading.Event()
+
+        with mock.patch.object(tryon, 'HEDGER', hedger), mock.patch.object(tryon, 'RATE_LIMITER', limiter), \
+                mock.patch.object(tryon, 'call_rapidapi_tryon_primary', self.method('primary', 0.2)), \
+                mock.patch.object(tryon, 'call_rapidapi_tryon_alt', self.method('alt', 0.4, alt_finished)):
+            result_path = tryon.fetch_hedged('k', None, None)
+            self.assertTrue(alt_finished.wait(5))
+
+        hedger.record_win.assert_called_once_with('primary')
+        with open(result_path, 'rb') as f:
+            self.assertEqual(f.read(), b'primary')
+        self.assertEqual(self.cached_bytes('k'), b'primary')
+        self.assertEqual(self.index.lookup('k').method, 'primary')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,25 @@
+import io
+import os
+import sys
+import unittest
+
+from werkzeug.formparser import parse_form_data
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from upstream import ALT_CONTENT_TYPE, alt_payload
+
+
+class AltPayloadTest(unittest.TestCase):
+    def test_carries_both_images(self):
+        model, garment = b'\xff\xd8model\r\n--bytes\xff\xd9', b'\xff\xd8garment\xff\xd9'
+        body = alt_payload(model, garment)
+        environ = {'REQUEST_METHOD': 'POST', 'wsgi.input': io.BytesIO(body), 'CONTENT_LENGTH': str(len(body)),
+                   'CONTENT_TYPE': ALT_CONTENT_TYPE}
+        _, _, files = parse_form_data(environ)
+        self.assertEqual(files['personImage'].read(), model)
+        self.assertEqual(files['clothImage'].read(), garment)
+
+
+if __name__ == '__main__':
+    unittest.main()
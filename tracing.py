@@ -0,0 +1,158 @@
+import sys
+import json
+import time
+import uuid
+import logging
+import threading
+import functools
+
+logger = logging.getLogger('tryon')
+_local = threading.local()
+_enabled = False
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: timestamp, level, event name and the event's fields"""
+
+    def format(self, record):
+        entry = {'ts': round(record.created, 3), 'level': record.levelname.lower(), 'event': record.getMessage()}
+        entry.update(getattr(record, 'fields', {}))
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def configure(enabled=False, level='INFO', path=None):
+    """Send JSON logs to `path` (stdout if unset) and turn per-stage timing on or off"""
+    global _enabled
+    _enabled = enabled
+    handler = logging.FileHandler(path) if path else logging.StreamHandler(sys.stdout)
+    handler.setFormatter(JsonFormatter())
+    logger.handlers[:] = [handler]
+    logger.setLevel(level.upper())
+    logger.propagate = False
+
+
+def log(event, level=logging.INFO, exc_info=False, **fields):
+    """Write a structured log line, tagged with the current trace id if there is one"""
+    if not logger.isEnabledFor(level):
+        return
+    trace = getattr(_local, 'trace', None)
+    if trace is not None:
+        fields['trace_id'] = trace.trace_id
+    logger.log(level, event, exc_info=exc_info, extra={'fields': fields})
+
+
+def debug(event, **fields):
+    log(event, logging.DEBUG, **fields)
+
+
+def warning(event, **fields):
+    log(event, logging.WARNING, **fields)
+
+
+def error(event, exc_info=False, **fields):
+    log(event, logging.ERROR, exc_info=exc_info, **fields)
+
+
+def debug_enabled():
+    """Whether debug lines are written; check before building expensive fields"""
+    return logger.isEnabledFor(logging.DEBUG)
+
+
+class Trace:
+    """Stage timings for one request, written as a single log line when it ends"""
+
+    def __init__(self, name, fields):
+        self.trace_id = uuid.uuid4().hex[:16]
+        self.name = name
+        self.fields = fields
+        self.started = time.perf_counter()
+        self.stages = []
+
+    def __enter__(self):
+        self._outer = getattr(_local, 'trace', None)
+        _local.trace = self
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _local.trace = self._outer
+        log('trace', name=self.name, status='error' if exc_type else 'ok',
+            total_ms=round((time.perf_counter() - self.started) * 1000, 2),
+            stages=self.stages, trace_id=self.trace_id, **self.fields)
+        return False
+
+
+class Span:
+    def __init__(self, trace, stage, fields):
+        self.trace = trace
+        self.stage = stage
+        self.fields = fields
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        stage = {'stage': self.stage, 'ms': round((time.perf_counter() - self.started) * 1000, 2)}
+        if exc_type:
+            stage['error'] = exc_type.__name__
+        stage.update(self.fields)
+        self.trace.stages.append(stage)
+        return False
+
+
+class _Noop:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NOOP = _Noop()
+
+
+def trace(name, **fields):
+    """Context manager timing one request; a shared no-op when tracing is disabled"""
+    if not _enabled:
+        return _NOOP
+    return Trace(name, fields)
+
+
+def span(stage, **fields):
+    """Context manager timing one stage of the current trace; a shared no-op outside a trace"""
+    if not _enabled:
+        return _NOOP
+    current = getattr(_local, 'trace', None)
+    if current is None:
+        return _NOOP
+    return Span(current, stage, fields)
+
+
+def bind(fn):
+    """Wrap fn so stages it runs on another thread land in the caller's trace"""
+    current = getattr(_local, 'trace', None)
+    if current is None:
+        return fn
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        outer = getattr(_local, 'trace', None)
+        _local.trace = current
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _local.trace = outer
+    return wrapper
+
+
+def traced(name):
+    """Decorator running each call of the function inside its own trace"""
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with trace(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
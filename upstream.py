@@ -0,0 +1,157 @@
+import time
+import requests
+from requests.adapters import HTTPAdapter
+
+import metrics
+
+try:
+    import httpx
+except ImportError:  # Only needed by the asyncio pipeline
+    httpx = None
+
+TRYON_PATH = "/clothes-virtual-tryon"
+
+# Responses that mean the upstream itself is unhealthy, as opposed to rejecting our input
+UNHEALTHY_STATUSES = {408, 429}
+
+# Method 2 encodes its multipart body by hand, in the layout of the RapidAPI example
+ALT_BOUNDARY = "---011000010111000001101001"
+ALT_CONTENT_TYPE = f"multipart/form-data; boundary={ALT_BOUNDARY}"
+
+
+def alt_payload(model_data, garment_data):
+    """The Method 2 request body carrying the person and garment images"""
+    parts = []
+    for name, filename, data in (('personImage', 'person.jpg', model_data), ('clothImage', 'garment.jpg', garment_data)):
+        parts.append(f"--{ALT_BOUNDARY}\r\n"
+                     f"Content-Disposition: form-data; name=\"{name}\"; filename=\"{filename}\"\r\n"
+                     "Content-Type: image/jpeg\r\n\r\n".encode('utf-8') + data + b"\r\n")
+    return b"".join(parts) + f"--{ALT_BOUNDARY}--\r\n".encode('utf-8')
+
+
+def record_outcome(breaker, method, started, status_code=None):
+    """Count an upstream call in the metrics and feed the circuit breaker; None means no response arrived"""
+    if status_code is None:
+        metrics.UPSTREAM_REQUESTS.labels(method, 'error').inc()
+        if breaker is not None:
+            breaker.record_failure()
+        return
+    metrics.UPSTREAM_LATENCY.labels(method).observe(time.time() - started)
+    metrics.UPSTREAM_REQUESTS.labels(method, str(status_code)).inc()
+    if breaker is not None:
+        if status_code >= 500 or status_code in UNHEALTHY_STATUSES:
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+
+
+class UpstreamClient:
+    """Shared, pooled HTTP client for the RapidAPI try-on endpoint and its result images"""
+
+    def __init__(self, base_url, api_key, api_host, pool_size=10, connect_timeout=5.0, read_timeout=60.0,
+                 breaker=None):
+        self.base_url = base_url.rstrip('/')
+        self.breaker = breaker
+        self.api_key = api_key
+        self.api_host = api_host
+        self.timeout = (connect_timeout, read_timeout)
+
+        # One keep-alive pool per host, reused by every request in this process
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def api_headers(self, extra=None):
+        """Headers for the try-on API; never sent to the image download host"""
+        headers = {
+            'x-rapidapi-key': self.api_key,
+            'x-rapidapi-host': self.api_host,
+        }
+        if extra:
+            headers.update(extra)
+        return headers
+
+    def post_tryon(self, model_data, garment_data):
+        """POST the person and garment images as multipart/form-data"""
+        files = {
+            'personImage': ('person.jpg', model_data, 'image/jpeg'),
+            'clothImage': ('garment.jpg', garment_data, 'image/jpeg')
+        }
+        return self._guarded('primary', lambda: self.session.post(f"{self.base_url}{TRYON_PATH}", files=files,
+                                                                  headers=self.api_headers(), timeout=self.timeout))
+
+    def post_tryon_raw(self, payload, content_type):
+        """POST a pre-encoded request body to the try-on endpoint"""
+        return self._guarded('alt', lambda: self.session.post(f"{self.base_url}{TRYON_PATH}", data=payload,
+                                                              headers=self.api_headers({'Content-Type': content_type}),
+                                                              timeout=self.timeout))
+
+    def _guarded(self, method, send):
+        """Send an API request through the circuit breaker, recording its status, latency and health"""
+        if self.breaker is not None:
+            self.breaker.before_call()
+        started = time.time()
+        try:
+            response = send()
+        except requests.RequestException:
+            record_outcome(self.breaker, method, started)
+            raise
+        record_outcome(self.breaker, method, started, response.status_code)
+        return response
+
+    def download(self, url, stream=False):
+        """GET a result image over the same pooled session"""
+        return self.session.get(url, timeout=self.timeout, stream=stream)
+
+
+class AsyncUpstreamClient:
+    """asyncio counterpart of UpstreamClient on httpx, so one process can hold hundreds of calls in flight"""
+
+    def __init__(self, base_url, api_key, api_host, max_connections=200, connect_timeout=5.0, read_timeout=60.0,
+                 breaker=None):
+        if httpx is None:
+            raise RuntimeError("The asyncio pipeline needs httpx: pip install httpx")
+        self.base_url = base_url.rstrip('/')
+        self.breaker = breaker
+        self.api_key = api_key
+        self.api_host = api_host
+        self.client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+            timeout=httpx.Timeout(read_timeout, connect=connect_timeout))
+
+    api_headers = UpstreamClient.api_headers
+
+    async def post_tryon(self, model_data, garment_data):
+        """POST the person and garment images as multipart/form-data"""
+        files = {
+            'personImage': ('person.jpg', model_data, 'image/jpeg'),
+            'clothImage': ('garment.jpg', garment_data, 'image/jpeg')
+        }
+        return await self._guarded('primary', lambda: self.client.post(f"{self.base_url}{TRYON_PATH}", files=files,
+                                                                       headers=self.api_headers()))
+
+    async def post_tryon_raw(self, payload, content_type):
+        """POST a pre-encoded request body to the try-on endpoint"""
+        return await self._guarded('alt', lambda: self.client.post(
+            f"{self.base_url}{TRYON_PATH}", content=payload, headers=self.api_headers({'Content-Type': content_type})))
+
+    async def _guarded(self, method, send):
+        """Send an API request through the circuit breaker, recording its status, latency and health"""
+        if self.breaker is not None:
+            self.breaker.before_call()
+        started = time.time()
+        try:
+            response = await send()
+        except httpx.HTTPError:
+            record_outcome(self.breaker, method, started)
+            raise
+        record_outcome(self.breaker, method, started, response.status_code)
+        return response
+
+    def download_stream(self, url):
+        """GET a result image over the same connection pool, as `async with client.download_stream(url) as r`"""
+        return self.client.stream('GET', url)
+
+    async def aclose(self):
+        await self.client.aclose()